@@ -0,0 +1,196 @@
+from __future__ import annotations
+from collections.abc import Sequence
+
+import numpy as np
+
+from pyutau.pyutau import UtauPlugin, Timeline, _format_floats, _is_rest
+
+__all__ = [
+    'PitchPreset',
+    'PRESETS',
+    'auto_pitch'
+    ]
+
+class PitchPreset:
+    """
+    A class for the style of generated Mode2 pitchbends. Times are in milliseconds and pitches in Mode2 units (10 cents).
+
+    Attributes
+    ----------
+    attack : float
+        How long before the start of the note the bend from the previous note starts.
+
+    rise : float
+        How long after the start of the note the bend reaches the note.
+
+    overshoot : float
+        How far the bend goes past the note, as a fraction of the interval.
+
+    settle : float
+        How long the bend takes to come back from the overshoot.
+
+    scoop : float
+        Where notes after rests start from. Negative scoops up into the note.
+
+    scoop_width : float
+        How long the scoop after rests takes.
+
+    tail : float
+        Where the pitch falls to at the end of a note before a rest. 0 for no tail.
+
+    tail_width : float
+        How long the tail takes.
+
+    curve : str
+        The PBM type of the bend. A blank string is the S-curve, linear is 's', R and J curve are 'r' and 'j'.
+
+    max_fraction : float
+        The most of a note the bend can take. Short notes get shorter bends.
+    """
+    def __init__(self, attack: float = 30, rise: float = 40, overshoot: float = 0, settle: float = 60,
+                 scoop: float = -5, scoop_width: float = 40, tail: float = 0, tail_width: float = 80,
+                 curve: str = '', max_fraction: float = 0.5):
+        self.attack: float = attack
+        self.rise: float = rise
+        self.overshoot: float = overshoot
+        self.settle: float = settle
+        self.scoop: float = scoop
+        self.scoop_width: float = scoop_width
+        self.tail: float = tail
+        self.tail_width: float = tail_width
+        self.curve: str = curve
+        self.max_fraction: float = max_fraction
+
+    def __repr__(self) -> str:
+        return f'PitchPreset({", ".join(f"{k}={v!r}" for k, v in vars(self).items())})'
+
+PRESETS = {
+    'natural' : PitchPreset(),
+    'smooth' : PitchPreset(attack = 60, rise = 60, scoop = -3, scoop_width = 60, max_fraction = 0.6),
+    'sharp' : PitchPreset(attack = 15, rise = 25, overshoot = 0.15, settle = 50, scoop = -8, scoop_width = 25,
+                          tail = -15, tail_width = 60),
+    'robotic' : PitchPreset(attack = 5, rise = 10, scoop = 0, scoop_width = 10, curve = 's', max_fraction = 0.2)
+}
+
+def auto_pitch(plugin: UtauPlugin, preset: str | PitchPreset = 'natural', overwrite: bool = False,
+               indices: Sequence[int] | None = None) -> int:
+    """
+    Generates Mode2 pitchbends for the notes of a plugin from the interval to the previous note, note length and tempo.
+
+    Parameters
+    ----------
+    plugin : UtauPlugin
+        The plugin data. The notes are changed in place.
+
+    preset : str or PitchPreset
+        The style of the pitchbends. Either a PitchPreset or the name of one in PRESETS. Default is 'natural'.
+
+    overwrite : bool
+        If notes that already have PBS get new pitchbends. Default is False, which leaves them alone.
+
+    indices : sequence of int or None
+        Only these indices of UtauPlugin.notes get pitchbends. Default is None, which is every note.
+
+    Returns
+    -------
+    count : int
+        The number of notes given pitchbends. Rests and DELETE notes are skipped.
+
+    Notes
+    -----
+    The PREV note is the previous note of the first note, and its length limits how early the first bend can start.
+    The NEXT note decides if the last note gets a tail.
+    The timing of every note is worked out at once with arrays, then the note data is written as strings directly.
+    """
+    if isinstance(preset, str):
+        preset = PRESETS[preset]
+    tl = Timeline(plugin)
+    n = len(tl)
+    if n == 0:
+        return 0
+
+    #Which notes to touch. Timeline skips DELETE notes, so map back through the note objects.
+    wanted = None
+    if indices != None:
+        wanted = {id(plugin.notes[i]) for i in indices}
+    rests = [_is_rest(note.note_data.get('Lyric')) for note in tl.notes]
+    targets = []
+    for i, note in enumerate(tl.notes):
+        if rests[i] or (wanted != None and id(note) not in wanted):
+            continue
+        if not overwrite and 'PBS' in note.note_data:
+            continue
+        targets.append(i)
+    if not targets:
+        return 0
+
+    idx = np.asarray(targets)
+    note_nums = np.asarray([note.get_note_num() for note in tl.notes], dtype = np.float64)
+    ms_lengths = np.asarray(tl.ms_lengths, dtype = np.float64)
+
+    prev_ms = np.empty(n)
+    prev_ms[1:] = ms_lengths[:-1]
+    prev_num = np.empty(n)
+    prev_num[1:] = note_nums[:-1]
+    prev_rest = np.zeros(n, dtype = bool)
+    prev_rest[1:] = rests[:-1]
+    prev = tl.prev_note
+    prev_rest[0] = prev == None or _is_rest(prev.note_data.get('Lyric'))
+    if not prev_rest[0]:
+        prev_num[0] = prev.get_note_num()
+        prev_tempo = prev.get_tempo() or tl.tempos[0]
+        prev_ms[0] = prev.get_length() * 125 / prev_tempo
+    else:
+        prev_num[0] = note_nums[0]
+        prev_ms[0] = 0
+
+    next_rest = np.zeros(n, dtype = bool)
+    next_rest[:-1] = rests[1:]
+    next_rest[-1] = tl.next_note == None or _is_rest(tl.next_note.note_data.get('Lyric'))
+
+    note_nums = note_nums[idx]
+    length = ms_lengths[idx]
+    from_rest = prev_rest[idx]
+    interval = np.where(from_rest, 0, (prev_num[idx] - note_nums) * 10)
+    budget = length * preset.max_fraction
+
+    #Bends from the previous note. Can't start before the previous note does.
+    attack = np.minimum(np.where(from_rest, 0, preset.attack), prev_ms[idx] * preset.max_fraction)
+    rise = np.where(from_rest, preset.scoop_width, preset.rise)
+    scale = np.minimum(1, budget / np.maximum(rise + np.where(interval != 0, preset.settle * (preset.overshoot > 0), 0), 1e-9))
+    rise = rise * scale
+    start_pitch = np.where(from_rest, preset.scoop, interval)
+    overshoot = -interval * preset.overshoot
+    settle = np.where(overshoot != 0, preset.settle * scale, 0)
+
+    #Tails go on notes before rests, and only if the bend leaves room for them.
+    used = rise + settle
+    tail_width = np.minimum(preset.tail_width, length - used)
+    has_tail = next_rest[idx] & (preset.tail != 0) & (tail_width > 0)
+    hold = length - used - tail_width
+
+    #Adding 0.0 turns -0.0 into 0.0, so nothing is written as '-0'.
+    columns = [(np.round(x, 1) + 0.0).tolist() for x in [-attack, rise, start_pitch, overshoot, settle, tail_width, hold]]
+    curve = preset.curve
+    count = 0
+    for j, (start, r, sp, ov, st, tw, hd) in enumerate(zip(*columns)):
+        pbw = [r - start]
+        pby = [ov]
+        if st:
+            pbw.append(st)
+            pby.append(0.0)
+        if has_tail[j]:
+            if hd > 0:
+                pbw.append(hd)
+                pby.append(pby[-1])
+            pbw.append(tw)
+            pby.append(preset.tail)
+        note = tl.notes[targets[j]]
+        note.note_data.update(
+            PBS = _format_floats([start]) + (';' + _format_floats([sp]) if sp else ''),
+            PBW = _format_floats(pbw),
+            PBY = _format_floats(pby),
+            PBM = ','.join([curve] * len(pbw))
+        )
+        count += 1
+    return count
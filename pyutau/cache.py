@@ -0,0 +1,372 @@
+from __future__ import annotations
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from pyutau.render import ResamplerJob, note_name
+
+__all__ = [
+    'RenderCache',
+    'render_key',
+    'tool_id'
+    ]
+
+def tool_id(tool) -> str:
+    """
+    Names a resampler or wavtool so renders from different tools don't share cache keys.
+
+    Parameters
+    ----------
+    tool : str, sequence of str or callable
+        The command, or a Python callable.
+
+    Returns
+    -------
+    name : str
+        The full path, size and modification time of the program with the rest of the command for commands,
+        or the module and name for callables.
+    """
+    if callable(tool):
+        return f'{getattr(tool, "__module__", "")}.{getattr(tool, "__qualname__", repr(tool))}'
+    cmd = [tool] if isinstance(tool, str) else list(tool)
+    program = shutil.which(cmd[0]) or cmd[0]
+    try:
+        stat = os.stat(program)
+        program = f'{os.path.abspath(program)}:{stat.st_size}:{stat.st_mtime_ns}'
+    except OSError:
+        pass
+    return '\0'.join([program, *cmd[1:]])
+
+def render_key(job: ResamplerJob, resampler: str = '') -> str:
+    """
+    Hashes everything that changes what the resampler renders for a job.
+
+    Parameters
+    ----------
+    job : ResamplerJob
+        The job.
+
+    resampler : str
+        Which resampler renders the job. See tool_id. Default is '', which is fine if a cache is only ever used with one resampler.
+
+    Returns
+    -------
+    key : str
+        The hex digest of the hash.
+
+    Notes
+    -----
+    This covers the sample and alias, NoteNum, requested length, Velocity, Flags, Intensity, Modulation,
+    StartPoint, tempo and the encoded pitchbend. The size and modification time of the sample are included so
+    re-recorded samples don't hit old renders. The output file is not included.
+    """
+    try:
+        stat = os.stat(job.input_file)
+        sample = f'{stat.st_size}:{stat.st_mtime_ns}'
+    except OSError:
+        sample = ''
+    note = job.note
+    parts = [
+        resampler, os.path.abspath(job.input_file), sample, note.get_alias() or note.get_lyric(),
+        note_name(job.note_num), *job.args()[3:],
+        note.note_data.get('@stpoint') or note.note_data.get('StartPoint') or ''
+        ]
+    return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+class RenderCache:
+    """
+    A content-addressed cache for rendered notes with a size limit. The least recently used renders are removed first.
+
+    Attributes
+    ----------
+    directory : str
+        Where the renders and the index are stored.
+
+    max_bytes : int
+        The size limit of the cache in bytes.
+
+    size : int
+        The current size of the cache in bytes.
+
+    hits : int
+        How many lookups found a render.
+
+    misses : int
+        How many lookups did not find a render.
+
+    evictions : int
+        How many renders were removed to stay under the size limit.
+    """
+    def __init__(self, directory: str | os.PathLike, max_bytes: int = 1 << 30):
+        """
+        Opens a cache, loading the index if there is one.
+
+        Parameters
+        ----------
+        directory : str or path-like
+            Where the renders and the index are stored. It is made if it doesn't exist.
+
+        max_bytes : int
+            The size limit of the cache in bytes. Default is 1 GiB.
+        """
+        self.directory: str = os.fspath(directory)
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        #Oldest first. Values are file sizes.
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        #Keys being read or written by some thread. Eviction leaves these alone.
+        self._busy: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        os.makedirs(self.directory, exist_ok = True)
+        self._load()
+
+    @property
+    def index_file(self) -> str:
+        '''The path of the index.'''
+        return os.path.join(self.directory, 'index.json')
+
+    def _load(self) -> None:
+        #Only the order of the keys is used from the index. Anything that isn't a list of pairs is thrown away,
+        #and the folder scan below rebuilds it.
+        broken = False
+        try:
+            with open(self.index_file, encoding = 'utf8') as f:
+                entries = json.load(f)
+            if not isinstance(entries, list):
+                raise ValueError('index is not a list')
+            order = [key for key, _ in entries]
+            if not all(isinstance(key, str) for key in order):
+                raise ValueError('index has keys that are not strings')
+        except OSError:
+            order = []
+        except (ValueError, TypeError):
+            order = []
+            broken = True
+
+        #The index is only as new as the last flush, so trust the folder for what's actually there.
+        #Renders from a run that was stopped early aren't in the index, and leftover .tmp files are garbage.
+        on_disk = {}
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir() or len(folder.name) != 2:
+                continue
+            for f in os.scandir(folder.path):
+                if f.name.endswith('.tmp'):
+                    try:
+                        os.remove(f.path)
+                    except OSError:
+                        pass
+                elif f.name.endswith('.wav'):
+                    stat = f.stat()
+                    on_disk[f.name[:-4]] = (stat.st_size, stat.st_mtime)
+
+        indexed = [key for key in order if key in on_disk]
+        unknown = sorted(set(on_disk).difference(indexed), key = lambda k: on_disk[k][1])
+        #Renders the index doesn't know about count as the oldest.
+        for key in unknown + indexed:
+            self._entries[key] = on_disk[key][0]
+            self.size += on_disk[key][0]
+        if broken or len(indexed) != len(order) or unknown:
+            self._dirty = True
+        self._evict()
+
+    def path(self, key: str) -> str:
+        """
+        Returns where the render for the key is stored.
+
+        Parameters
+        ----------
+        key : str
+            The key. See render_key.
+        """
+        return os.path.join(self.directory, key[:2], key + '.wav')
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> str | None:
+        """
+        Looks up a render and marks it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            The key. See render_key.
+
+        Returns
+        -------
+        path : str or None
+            The path of the render, if it is cached.
+
+        Notes
+        -----
+        Another thread can evict the render before the path is used. Use get_into when other threads use the cache.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._dirty = True
+                self.hits += 1
+                return self.path(key)
+            self.misses += 1
+            return None
+
+    def get_into(self, key: str, fpath: str | os.PathLike) -> bool:
+        """
+        Copies a render out of the cache and marks it as recently used. The render can't be evicted while it's copied.
+
+        Parameters
+        ----------
+        key : str
+            The key. See render_key.
+
+        fpath : str or path-like
+            Where to copy the render to.
+
+        Returns
+        -------
+        found : bool
+            If the render was cached and copied. A render that was removed from the folder counts as not cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self._busy[key] = self._busy.get(key, 0) + 1
+        try:
+            shutil.copyfile(self.path(key), fpath)
+            found = True
+        except FileNotFoundError:
+            found = False
+        with self._lock:
+            self._release(key)
+            self._dirty = True
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.size -= self._entries.pop(key, 0)
+        return found
+
+    def _release(self, key: str) -> None:
+        count = self._busy[key] - 1
+        if count:
+            self._busy[key] = count
+        else:
+            del self._busy[key]
+
+    def put(self, key: str, fpath: str | os.PathLike) -> str:
+        """
+        Copies a render into the cache and removes old renders if the cache gets too big.
+
+        Parameters
+        ----------
+        key : str
+            The key. See render_key.
+
+        fpath : str or path-like
+            The render.
+
+        Returns
+        -------
+        path : str
+            The path of the render in the cache.
+        """
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok = True)
+        tmp = f'{dest}.{threading.get_ident()}.tmp'
+        with self._lock:
+            self._busy[key] = self._busy.get(key, 0) + 1
+        try:
+            #The copy is the slow part, so only that happens outside the lock.
+            shutil.copyfile(fpath, tmp)
+            size = os.path.getsize(tmp)
+            with self._lock:
+                os.replace(tmp, dest)
+                self.size += size - self._entries.pop(key, 0)
+                self._entries[key] = size
+                self._dirty = True
+                self._evict()
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        finally:
+            with self._lock:
+                self._release(key)
+        return dest
+
+    def _evict(self) -> None:
+        #Always keeps the newest render, even if it's bigger than the limit by itself. Busy renders are skipped.
+        if self.size <= self.max_bytes or len(self._entries) <= 1:
+            return
+        newest = next(reversed(self._entries))
+        victims = []
+        size = self.size
+        for key, entry_size in self._entries.items():
+            if size <= self.max_bytes:
+                break
+            if key != newest and key not in self._busy:
+                victims.append(key)
+                size -= entry_size
+        for key in victims:
+            self.size -= self._entries.pop(key)
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def flush(self) -> None:
+        '''Writes the index to disk if it changed.'''
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp = self.index_file + '.tmp'
+            with open(tmp, 'w', encoding = 'utf8') as f:
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp, self.index_file)
+            self._dirty = False
+
+    def clear(self) -> None:
+        '''Removes every render from the cache.'''
+        with self._lock:
+            for key in self._entries:
+                try:
+                    os.remove(self.path(key))
+                except OSError:
+                    pass
+            self._entries.clear()
+            self.size = 0
+            self._dirty = True
+        self.flush()
+
+    def stats(self) -> dict[str, int | float]:
+        '''Returns the hits, misses, evictions, entries, size and hit rate of the cache.'''
+        lookups = self.hits + self.misses
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'evictions' : self.evictions,
+            'entries' : len(self._entries),
+            'size' : self.size,
+            'hit_rate' : self.hits / lookups if lookups else 0.0
+        }
+
+    def __enter__(self) -> RenderCache:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.flush()
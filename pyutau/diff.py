@@ -0,0 +1,386 @@
+from __future__ import annotations
+from collections.abc import Sequence
+
+from pyutau.pyutau import Note, UtauPlugin
+
+__all__ = [
+    'NoteChange',
+    'Conflict',
+    'diff',
+    'merge',
+    'to_plugin'
+    ]
+
+_MISSING = object()
+
+class NoteChange:
+    """
+    A class for one changed note between two versions of a UST.
+
+    Attributes
+    ----------
+    kind : str
+        'insert', 'delete' or 'modify'.
+
+    old_index : int
+        The index of the note in the old notes. For inserts, this is the index of the old note it comes before.
+
+    new_index : int or None
+        The index of the note in the new notes. None for deletes.
+
+    old : Note or None
+        The old note. None for inserts.
+
+    new : Note or None
+        The new note. None for deletes.
+
+    added : dict of str to str or None
+        Note data that only the new note has.
+
+    removed : dict of str to str or None
+        Note data that only the old note has.
+
+    changed : dict of str to tuple of str or None
+        Note data that both notes have with different values, as (old, new).
+    """
+    def __init__(self, kind: str, old_index: int, new_index: int | None, old: Note | None, new: Note | None):
+        self.kind: str = kind
+        self.old_index: int = old_index
+        self.new_index: int | None = new_index
+        self.old: Note | None = old
+        self.new: Note | None = new
+        self.added: dict[str, str | None] = {}
+        self.removed: dict[str, str | None] = {}
+        self.changed: dict[str, tuple[str | None, str | None]] = {}
+        if old and new:
+            for k, v in new.note_data.items():
+                if k not in old.note_data:
+                    self.added[k] = v
+                elif old.note_data[k] != v:
+                    self.changed[k] = (old.note_data[k], v)
+            for k, v in old.note_data.items():
+                if k not in new.note_data:
+                    self.removed[k] = v
+
+    def apply(self, note: Note) -> None:
+        """
+        Applies the key-level changes of a modify to a note.
+
+        Parameters
+        ----------
+        note : Note
+            The note to change.
+        """
+        for k in self.removed:
+            note.note_data.pop(k, None)
+        for k, v in self.added.items():
+            note.note_data[k] = v
+        for k, (_, v) in self.changed.items():
+            note.note_data[k] = v
+
+    def __repr__(self) -> str:
+        keys = [*self.added, *self.removed, *self.changed]
+        return f'NoteChange({self.kind!r}, {self.old_index}, {self.new_index}{", " + repr(keys) if keys else ""})'
+
+class Conflict:
+    """
+    A class for a place where both sides of a merge changed the same thing differently.
+
+    Attributes
+    ----------
+    kind : str
+        'insert' when both sides inserted different notes at the same place, 'delete' when one side deleted a note the
+        other side modified, or 'modify' when both sides changed the same note data differently.
+
+    base_index : int
+        The index of the note in the base notes. For inserts, this is the index of the base note they come before.
+
+    ours : NoteChange or list of NoteChange or None
+        Our change. Inserts are a list of changes.
+
+    theirs : NoteChange or list of NoteChange or None
+        Their change. Inserts are a list of changes.
+
+    keys : list of str
+        The note data both sides changed differently, for modify conflicts.
+    """
+    def __init__(self, kind: str, base_index: int, ours, theirs, keys: Sequence[str] = ()):
+        self.kind: str = kind
+        self.base_index: int = base_index
+        self.ours = ours
+        self.theirs = theirs
+        self.keys: list[str] = list(keys)
+
+    def __repr__(self) -> str:
+        return f'Conflict({self.kind!r}, {self.base_index}{", " + repr(self.keys) if self.keys else ""})'
+
+def _notes(notes: UtauPlugin | Sequence[Note]) -> list[Note]:
+    if isinstance(notes, UtauPlugin):
+        return notes.get_notes()
+    return [note for note in notes if not note.is_deleted]
+
+#Past this many edits between two aligned notes, the notes in between are just paired up in order.
+_MAX_EDITS = 1000
+
+def _middle_snake(a: list[int], b: list[int], a0: int, a1: int, b0: int, b1: int) -> tuple[int, int, int, int] | None:
+    #Myers' forward and reverse searches meet in the middle of the shortest edit script.
+    #Returns the snake where they meet as (x, y, u, v) relative to a0 and b0, or None if it takes too many edits.
+    n = a1 - a0
+    m = b1 - b0
+    delta = n - m
+    odd = delta & 1
+    size = n + m + 2
+    vf = [0] * (2 * size + 1)
+    vb = [0] * (2 * size + 1)
+    for d in range(min((n + m + 1) // 2, _MAX_EDITS // 2) + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[k - 1] < vf[k + 1]):
+                x = vf[k + 1]
+            else:
+                x = vf[k - 1] + 1
+            y = x - k
+            start_x = x
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            vf[k] = x
+            if odd and -d < delta - k < d and x + vb[delta - k] >= n:
+                return start_x, start_x - k, x, y
+        #The reverse search works from the ends, so x and y count notes from the end here.
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[k - 1] < vb[k + 1]):
+                x = vb[k + 1]
+            else:
+                x = vb[k - 1] + 1
+            y = x - k
+            start_x = x
+            while x < n and y < m and a[a1 - 1 - x] == b[b1 - 1 - y]:
+                x += 1
+                y += 1
+            vb[k] = x
+            if not odd and -d <= delta - k <= d and x + vf[delta - k] >= n:
+                return n - x, m - y, n - start_x, m - start_x + k
+    return None
+
+def _align(a: list[int], b: list[int], a0: int, a1: int, b0: int, b1: int, res: list[tuple[int, int]]) -> None:
+    #Adds the matched index pairs of the shortest edit script to res in order. O((N + M) D) time and O(N + M) space.
+    while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+        res.append((a0, b0))
+        a0 += 1
+        b0 += 1
+    end = []
+    while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+        a1 -= 1
+        b1 -= 1
+        end.append((a1, b1))
+    if a0 < a1 and b0 < b1:
+        #With the common ends gone there are at least 2 edits, so both halves have fewer edits and this stops.
+        snake = _middle_snake(a, b, a0, a1, b0, b1)
+        if snake != None:
+            x, y, u, v = snake
+            _align(a, b, a0, a0 + x, b0, b0 + y, res)
+            res.extend((a0 + i, b0 + y + i - x) for i in range(x, u))
+            _align(a, b, a0 + u, a1, b0 + v, b1, res)
+    end.reverse()
+    res.extend(end)
+
+def diff(old: UtauPlugin | Sequence[Note], new: UtauPlugin | Sequence[Note]) -> list[NoteChange]:
+    """
+    Compares two versions of a UST note by note. DELETE notes are ignored.
+
+    Parameters
+    ----------
+    old : UtauPlugin or sequence of Note
+        The old notes.
+
+    new : UtauPlugin or sequence of Note
+        The new notes.
+
+    Returns
+    -------
+    changes : list of NoteChange
+        The changes in order.
+
+    Notes
+    -----
+    Notes are aligned by lyric and length with the linear-space version of Myers' O(ND) algorithm, so section numbers
+    don't matter and transposed notes are modifies. Aligned notes with different note data are modifies. Deletes and
+    inserts between the same aligned notes are paired up as modifies in order, since that's usually an edit of the lyric
+    or length. Stretches that differ by more than about 1000 edits are paired up the same way instead of aligned.
+    """
+    a = _notes(old)
+    b = _notes(new)
+    ids = {}
+    def keys(notes: list[Note]) -> list[int]:
+        res = []
+        for note in notes:
+            data = note.note_data
+            res.append(ids.setdefault((data.get('Lyric'), data.get('Length')), len(ids)))
+        return res
+    matches = []
+    _align(keys(a), keys(b), 0, len(a), 0, len(b), matches)
+    matches.append((len(a), len(b)))
+
+    res = []
+    x = 0
+    y = 0
+    for mx, my in matches:
+        #Everything between matches was deleted or inserted. Pair them up first.
+        paired = min(mx - x, my - y)
+        for i in range(paired):
+            res.append(NoteChange('modify', x + i, y + i, a[x + i], b[y + i]))
+        for i in range(x + paired, mx):
+            res.append(NoteChange('delete', i, None, a[i], None))
+        for j in range(y + paired, my):
+            res.append(NoteChange('insert', mx, j, None, b[j]))
+        if mx < len(a) and a[mx].note_data != b[my].note_data:
+            res.append(NoteChange('modify', mx, my, a[mx], b[my]))
+        x = mx + 1
+        y = my + 1
+    return res
+
+def to_plugin(base: UtauPlugin, changes: Sequence[NoteChange]) -> UtauPlugin:
+    """
+    Makes a plugin-format UST that applies changes to the notes UTAU sent.
+
+    Parameters
+    ----------
+    base : UtauPlugin
+        The plugin data the changes were made against.
+
+    changes : sequence of NoteChange
+        The changes from diff(base, ...).
+
+    Returns
+    -------
+    plugin : UtauPlugin
+        The plugin data to write back. Unchanged notes only have their section, modified notes only have their changed
+        data, removed notes are DELETE notes and new notes are INSERT notes.
+
+    Notes
+    -----
+    UTAU never clears note data that isn't returned, so a modify that removes note data is written as a DELETE note
+    followed by an INSERT note.
+    """
+    notes = _notes(base)
+    by_index = {}
+    inserts = {}
+    for change in changes:
+        if change.kind == 'insert':
+            inserts.setdefault(change.old_index, []).append(change)
+        else:
+            by_index[change.old_index] = change
+
+    res = UtauPlugin.from_bytes(b'')
+    res.prev_note = base.prev_note
+    res.next_note = base.next_note
+    res.version = base.version
+    res.settings = base.settings
+    res.encoding = base.encoding
+    for i in range(len(notes) + 1):
+        for change in inserts.get(i, []):
+            note = change.new.copy()
+            note.note_type = 'INSERT'
+            note.is_deleted = False
+            res.notes.append(note)
+        if i == len(notes):
+            break
+        change = by_index.get(i)
+        note = Note(notes[i].note_type)
+        note.note_data = {}
+        if change == None:
+            res.notes.append(note)
+        elif change.kind == 'delete':
+            note.delete_note()
+            res.notes.append(note)
+        elif change.removed:
+            note.delete_note()
+            res.notes.append(note)
+            new = change.new.copy()
+            new.note_type = 'INSERT'
+            res.notes.append(new)
+        else:
+            change.apply(note)
+            res.notes.append(note)
+    return res
+
+def merge(base: UtauPlugin | Sequence[Note], ours: UtauPlugin | Sequence[Note],
+          theirs: UtauPlugin | Sequence[Note]) -> tuple[list[Note], list[Conflict]]:
+    """
+    Merges two versions of a UST made from the same base.
+
+    Parameters
+    ----------
+    base : UtauPlugin or sequence of Note
+        The notes both versions started from.
+
+    ours : UtauPlugin or sequence of Note
+        Our version.
+
+    theirs : UtauPlugin or sequence of Note
+        Their version.
+
+    Returns
+    -------
+    notes : list of Note
+        The merged notes. Conflicts are resolved with our version.
+
+    conflicts : list of Conflict
+        Where both versions changed the same thing differently.
+
+    Notes
+    -----
+    Modifies of the same note are merged key by key, so only note data changed differently on both sides conflicts.
+    """
+    notes = _notes(base)
+    sides = []
+    for other in [ours, theirs]:
+        by_index = {}
+        inserts = {}
+        for change in diff(notes, other):
+            if change.kind == 'insert':
+                inserts.setdefault(change.old_index, []).append(change)
+            else:
+                by_index[change.old_index] = change
+        sides.append((by_index, inserts))
+    (our_changes, our_inserts), (their_changes, their_inserts) = sides
+
+    res = []
+    conflicts = []
+    for i in range(len(notes) + 1):
+        a = our_inserts.get(i, [])
+        b = their_inserts.get(i, [])
+        if a and b and [x.new.note_data for x in a] != [x.new.note_data for x in b]:
+            conflicts.append(Conflict('insert', i, a, b))
+        res.extend(x.new.copy() for x in (a or b))
+        if i == len(notes):
+            break
+
+        a = our_changes.get(i)
+        b = their_changes.get(i)
+        if a == None and b == None:
+            res.append(notes[i].copy())
+            continue
+        if a == None or b == None:
+            change = a or b
+            if change.kind == 'modify':
+                res.append(change.new.copy())
+            continue
+        if a.kind == 'delete' or b.kind == 'delete':
+            if a.kind != b.kind:
+                conflicts.append(Conflict('delete', i, a, b))
+                if a.kind == 'modify':
+                    res.append(a.new.copy())
+            continue
+
+        #Both modified. Take every change, preferring ours where they disagree.
+        keys = [k for k in {**a.added, **a.changed, **a.removed}
+                if k in {**b.added, **b.changed, **b.removed}
+                and a.new.note_data.get(k, _MISSING) != b.new.note_data.get(k, _MISSING)]
+        if keys:
+            conflicts.append(Conflict('modify', i, a, b, keys))
+        note = notes[i].copy()
+        b.apply(note)
+        a.apply(note)
+        res.append(note)
+    return res, conflicts
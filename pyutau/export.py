@@ -0,0 +1,435 @@
+from __future__ import annotations
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+
+import numpy as np
+
+from pyutau.pyutau import _is_rest, _parse_floats
+from pyutau.stats import iter_sections
+
+__all__ = [
+    'CorpusExporter',
+    'CorpusDataset',
+    'NOTE_COLUMNS'
+    ]
+
+#Column name and dtype of every per-note array.
+NOTE_COLUMNS = {
+    'file_id' : np.int32,
+    'onset_ticks' : np.int64,
+    'onset_ms' : np.float64,
+    'length_ticks' : np.int32,
+    'length_ms' : np.float32,
+    'note_num' : np.int16,
+    'lyric_id' : np.int32,
+    'intensity' : np.float32
+}
+
+#Pitch curves are sampled every 5 ticks like Mode1 pitchbends.
+PITCH_STEP = 5
+
+#Only the note data the columns and pitch curves need is kept by the section-level parse.
+_EXPORT_KEYS = {'Length', 'Lyric', 'NoteNum', 'Tempo', 'Intensity', 'PBS', 'PBW', 'PBY', 'PBM', 'VBR', 'PBStart', 'PitchBend'}
+_VBR_DEFAULT = [65, 180, 35, 20, 20, 0, 0]
+#What Note starts with, so notes missing these come out the same as with a full parse.
+_NOTE_DEFAULTS = {'Length' : '480', 'Lyric' : 'あ', 'NoteNum' : '60'}
+
+def _sample_pitch(notes: list[dict[str, str]], prev: dict[str, str] | None, note_nums: np.ndarray,
+                  lengths: np.ndarray, tempos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    #Same curves as render.pitch_curve sampled every PITCH_STEP ticks, but for every note at once.
+    counts = np.maximum(lengths // PITCH_STEP, 1)
+    offsets = np.zeros(len(notes) + 1, dtype = np.int64)
+    np.cumsum(counts, out = offsets[1:])
+    owner = np.repeat(np.arange(len(notes)), counts)
+    step = PITCH_STEP * 125 / tempos
+    times = (np.arange(offsets[-1]) - offsets[owner]) * step[owner]
+    res = np.zeros(len(times), dtype = np.float64)
+
+    #Control points of every Mode2 note in one flat list, keyed by note so one searchsorted finds every segment.
+    xs = []
+    ys = []
+    shapes = []
+    point_owner = []
+    vibratos = []
+    mode1 = []
+    for i, note in enumerate(notes):
+        if 'PBS' in note:
+            pbs = note['PBS'].split(';')
+            if len(pbs) >= 2:
+                start = float(pbs[1]) * 10 if len(pbs) == 2 and pbs[1] != '' else 0.0
+            else:
+                before = notes[i - 1] if i > 0 else prev
+                start = 0.0
+                if before != None and not _is_rest(before.get('Lyric')):
+                    start = (int(before['NoteNum']) - note_nums[i]) * 100.0
+            pbw = _parse_floats(note['PBW'])
+            pby = _parse_floats(note['PBY']) if 'PBY' in note else []
+            pbm = note['PBM'].split(',') if 'PBM' in note else []
+            x = float(pbs[0])
+            xs.append(x)
+            ys.append(start)
+            for k, w in enumerate(pbw):
+                x += w
+                xs.append(x)
+                ys.append(pby[k] * 10 if k < len(pby) else 0.0)
+            shapes.extend(pbm[k] if k < len(pbm) else '' for k in range(len(pbw)))
+            shapes.append('')
+            point_owner.extend([i] * (len(pbw) + 1))
+            if 'VBR' in note:
+                vbr = _parse_floats(note['VBR'])
+                vibratos.append((i, vbr if len(vbr) >= 7 else _VBR_DEFAULT))
+        elif 'PitchBend' in note:
+            start = float(note['PBStart']) if note.get('PBStart', '') != '' else 0.0
+            mode1.append((i, start, np.asarray(_parse_floats(note['PitchBend']))))
+
+    if xs:
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        point_owner = np.asarray(point_owner)
+        #Shift each note's points and samples into their own range so the whole list stays sorted.
+        span = 2 * max(np.abs(xs).max(), np.abs(times).max()) + 1
+        keys = xs + point_owner * span
+        first = np.searchsorted(point_owner, np.arange(len(notes)))
+        last = np.searchsorted(point_owner, np.arange(len(notes)), 'right')
+        sel = np.flatnonzero((last > first)[owner])
+        n_own = owner[sel]
+        t = times[sel]
+        j = np.searchsorted(keys, t + n_own * span) - 1
+        lo = first[n_own]
+        hi = last[n_own] - 1
+        before_start = j < lo
+        after_end = j >= hi
+        j = np.clip(j, lo, np.maximum(hi - 1, lo))
+        j1 = np.minimum(j + 1, hi)
+        width = xs[j1] - xs[j]
+        x = np.divide(t - xs[j], width, out = np.ones_like(t), where = width != 0)
+        shape = np.asarray(shapes)[j]
+        curve = np.select([shape == 's', shape == 'r', shape == 'j'],
+                          [x, np.sin(x * np.pi / 2), 1 - np.cos(x * np.pi / 2)], (1 - np.cos(x * np.pi)) / 2)
+        value = ys[j] + (ys[j1] - ys[j]) * curve
+        value = np.where(after_end, ys[hi], value)
+        value = np.where(before_start, ys[lo], value)
+        res[sel] = value
+
+    if vibratos:
+        vib_owner = np.asarray([i for i, _ in vibratos])
+        #Length, cycle, depth, fade in, fade out, phase and offset of each vibrato.
+        vib = np.asarray([vbr[:7] for _, vbr in vibratos], dtype = np.float64)
+        valid = (vib[:, 0] > 0) & (vib[:, 1] > 0)
+        vib_owner = vib_owner[valid]
+        vib = vib[valid]
+        row = np.full(len(notes), -1)
+        row[vib_owner] = np.arange(len(vib_owner))
+        sel = np.flatnonzero(row[owner] >= 0)
+        length_pct, cycle, depth, fade_in, fade_out, phase, offset = vib[row[owner[sel]]].T
+        t = times[sel]
+        length = (lengths * 125 / tempos)[owner[sel]]
+        vbr_length = length * length_pct / 100
+        vbr_start = length - vbr_length
+        fade_in = vbr_length * fade_in / 100
+        fade_out = vbr_length * fade_out / 100
+        x = t - vbr_start
+        fade = np.ones_like(t)
+        fade = np.where((fade_in != 0) & (x < fade_in), np.divide(x, fade_in, out = fade.copy(), where = fade_in != 0), fade)
+        end = length - t
+        fade = np.where((fade_out != 0) & (end < fade_out),
+                        np.minimum(fade, np.divide(end, fade_out, out = fade.copy(), where = fade_out != 0)), fade)
+        wave = np.sin(2 * np.pi * (x / cycle + phase / 100))
+        inside = (t >= vbr_start) & (t <= length)
+        res[sel] += np.where(inside, fade * depth * (wave + offset / 100), 0)
+
+    for i, start, values in mode1:
+        t = times[offsets[i]:offsets[i + 1]]
+        points = np.clip(np.round((t - start) / step[i]).astype(np.int64), 0, len(values) - 1)
+        res[offsets[i]:offsets[i + 1]] = values[points]
+
+    pitch = (res + np.repeat(note_nums * 100, counts)).astype(np.float32)
+    return pitch, offsets
+
+def _extract(fpath: str) -> tuple[str, dict | None, list[str], str | None]:
+    #Runs in the worker processes. Lyrics are sent back as strings so the parent can give out the ids.
+    #Only a section-level parse is done. No Note objects are made.
+    try:
+        with open(fpath, 'rb') as f:
+            data = f.read()
+        settings = {}
+        prev = None
+        notes = []
+        for name, section in iter_sections(data, keys = _EXPORT_KEYS):
+            if name == 'SETTING':
+                settings = section
+            elif name == 'PREV':
+                prev = {**_NOTE_DEFAULTS, **section}
+            elif name.isdigit() or name == 'INSERT':
+                notes.append({**_NOTE_DEFAULTS, **section})
+
+        #Same tempo rules as Timeline.
+        tempo = None
+        if prev and prev.get('Tempo'):
+            tempo = float(prev['Tempo'])
+        if tempo == None and settings.get('Tempo'):
+            tempo = float(settings['Tempo'])
+        if tempo == None:
+            tempo = 120.0
+        tempos = []
+        for note in notes:
+            if 'Tempo' in note:
+                tempo = float(note['Tempo'])
+            tempos.append(tempo)
+
+        lengths = np.asarray([int(note['Length']) for note in notes], dtype = np.int64)
+        tempos = np.asarray(tempos, dtype = np.float64)
+        note_nums = np.asarray([int(note['NoteNum']) for note in notes], dtype = np.int64)
+        ms_lengths = lengths * 125 / tempos
+        onset_ticks = np.zeros(len(notes), dtype = np.int64)
+        np.cumsum(lengths[:-1], out = onset_ticks[1:])
+        onset_ms = np.zeros(len(notes), dtype = np.float64)
+        np.cumsum(ms_lengths[:-1], out = onset_ms[1:])
+        intensity = [float(note['Intensity']) if 'Intensity' in note else 100 for note in notes]
+
+        arrays = {
+            'onset_ticks' : onset_ticks,
+            'onset_ms' : onset_ms,
+            'length_ticks' : lengths,
+            'length_ms' : ms_lengths,
+            'note_num' : note_nums,
+            'intensity' : np.asarray(intensity)
+        }
+        arrays = {k: v.astype(NOTE_COLUMNS[k], copy = False) for k, v in arrays.items()}
+        arrays['pitch'], arrays['pitch_offsets'] = _sample_pitch(notes, prev, note_nums, lengths, tempos)
+        return fpath, arrays, [note['Lyric'] for note in notes], None
+    except Exception as e:
+        return fpath, None, [], f'{type(e).__name__}: {e}'
+
+class CorpusExporter:
+    """
+    Exports USTs to a folder of columnar chunks that can be memory-mapped for training.
+
+    Attributes
+    ----------
+    directory : str
+        The output folder.
+
+    chunk_size : int
+        The number of notes per chunk. Chunks only end between files, so they can be a bit bigger.
+
+    lyrics : list of str
+        The lyric of each lyric id.
+
+    files : list of dict
+        The exported files. Each has the path, chunk, first note in the chunk, and note count.
+
+    errors : dict of str to str
+        The files that couldn't be parsed, with the reason.
+
+    chunks : list of str
+        The chunk names in order.
+
+    Notes
+    -----
+    Each chunk is a folder of .npy files, one for each of NOTE_COLUMNS plus pitch and pitch_offsets.
+    The pitch curves of all notes in a chunk are stored in one flat array of absolute cents (NoteNum * 100 plus the pitchbend),
+    sampled every 5 ticks. The curve of note i is pitch[pitch_offsets[i]:pitch_offsets[i + 1]].
+    The manifest.json file keeps track of everything, so exporting more files later appends new chunks.
+    Files are read section by section like iter_sections, without Note objects, and the pitch curves of all notes in a
+    file are sampled at once. They match render.pitch_curve.
+    """
+    def __init__(self, directory: str | os.PathLike, chunk_size: int = 1 << 16):
+        """
+        Opens an export folder, loading the manifest if there is one.
+
+        Parameters
+        ----------
+        directory : str or path-like
+            The output folder. It is made if it doesn't exist.
+
+        chunk_size : int
+            The number of notes per chunk. Default is 65536.
+        """
+        self.directory: str = os.fspath(directory)
+        self.chunk_size: int = chunk_size
+        self.lyrics: list[str] = []
+        self.files: list[dict] = []
+        self.errors: dict[str, str] = {}
+        self.chunks: list[str] = []
+        os.makedirs(self.directory, exist_ok = True)
+        manifest = os.path.join(self.directory, 'manifest.json')
+        if os.path.exists(manifest):
+            with open(manifest, encoding = 'utf8') as f:
+                data = json.load(f)
+            self.lyrics = data['lyrics']
+            self.files = data['files']
+            self.errors = data['errors']
+            self.chunks = data['chunks']
+        self._lyric_ids: dict[str, int] = {x: i for i, x in enumerate(self.lyrics)}
+        self._done: set[str] = {x['path'] for x in self.files}
+        self._pending: list[tuple[dict, str]] = []
+        self._pending_notes = 0
+
+    def _lyric_id(self, lyric: str) -> int:
+        res = self._lyric_ids.get(lyric)
+        if res == None:
+            res = self._lyric_ids[lyric] = len(self.lyrics)
+            self.lyrics.append(lyric)
+        return res
+
+    def export(self, paths: Iterable[str | os.PathLike], workers: int | None = None) -> int:
+        """
+        Exports USTs, skipping the ones that were already exported.
+
+        Parameters
+        ----------
+        paths : iterable of str or path-like
+            The USTs.
+
+        workers : int or None
+            The number of worker processes. Default is None, which lets the executor decide. 0 parses in this process.
+
+        Returns
+        -------
+        count : int
+            The number of files exported.
+        """
+        todo = [os.path.abspath(p) for p in paths]
+        todo = list(dict.fromkeys(p for p in todo if p not in self._done))
+        count = 0
+        if workers == 0:
+            results = map(_extract, todo)
+            count = self._collect(results)
+        else:
+            with ProcessPoolExecutor(max_workers = workers) as executor:
+                count = self._collect(executor.map(_extract, todo, chunksize = 16))
+        self.flush()
+        return count
+
+    def _collect(self, results: Iterable[tuple[str, dict | None, list[str], str | None]]) -> int:
+        count = 0
+        for fpath, arrays, lyrics, error in results:
+            if error != None:
+                self.errors[fpath] = error
+                continue
+            #It might have failed in an earlier export.
+            self.errors.pop(fpath, None)
+            arrays['lyric_id'] = np.asarray([self._lyric_id(x) for x in lyrics], dtype = NOTE_COLUMNS['lyric_id'])
+            self._pending.append((arrays, fpath))
+            self._pending_notes += len(lyrics)
+            self._done.add(fpath)
+            count += 1
+            if self._pending_notes >= self.chunk_size:
+                self._write_chunk()
+        return count
+
+    def _write_chunk(self) -> None:
+        if not self._pending:
+            return
+        name = f'chunk_{len(self.chunks):05d}'
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok = True)
+
+        columns = {k: [] for k in NOTE_COLUMNS}
+        pitches = []
+        offsets = [np.zeros(1, dtype = np.int64)]
+        start = 0
+        pitch_start = 0
+        for arrays, fpath in self._pending:
+            n = len(arrays['lyric_id'])
+            file_id = len(self.files)
+            self.files.append({'path' : fpath, 'chunk' : name, 'start' : start, 'count' : n})
+            arrays['file_id'] = np.full(n, file_id, dtype = NOTE_COLUMNS['file_id'])
+            for k in NOTE_COLUMNS:
+                columns[k].append(arrays[k])
+            pitches.append(arrays['pitch'])
+            offsets.append(arrays['pitch_offsets'][1:] + pitch_start)
+            pitch_start += len(arrays['pitch'])
+            start += n
+
+        for k, v in columns.items():
+            np.save(os.path.join(path, k + '.npy'), np.concatenate(v).astype(NOTE_COLUMNS[k], copy = False))
+        np.save(os.path.join(path, 'pitch.npy'), np.concatenate(pitches).astype(np.float32, copy = False))
+        np.save(os.path.join(path, 'pitch_offsets.npy'), np.concatenate(offsets))
+
+        self.chunks.append(name)
+        self._pending = []
+        self._pending_notes = 0
+
+    def flush(self) -> None:
+        '''Writes the pending files as a chunk and saves the manifest.'''
+        self._write_chunk()
+        manifest = os.path.join(self.directory, 'manifest.json')
+        tmp = manifest + '.tmp'
+        with open(tmp, 'w', encoding = 'utf8') as f:
+            json.dump({
+                'pitch_step' : PITCH_STEP,
+                'lyrics' : self.lyrics,
+                'files' : self.files,
+                'errors' : self.errors,
+                'chunks' : self.chunks
+            }, f, ensure_ascii = False)
+        os.replace(tmp, manifest)
+
+class CorpusDataset:
+    """
+    Reads a folder made by CorpusExporter. Arrays are memory-mapped, so nothing is loaded until it's used.
+
+    Attributes
+    ----------
+    directory : str
+        The export folder.
+
+    lyrics : list of str
+        The lyric of each lyric id.
+
+    files : list of dict
+        The exported files. Each has the path, chunk, first note in the chunk, and note count.
+
+    chunks : list of str
+        The chunk names in order.
+    """
+    def __init__(self, directory: str | os.PathLike):
+        """
+        Opens an export folder.
+
+        Parameters
+        ----------
+        directory : str or path-like
+            The export folder.
+        """
+        self.directory: str = os.fspath(directory)
+        with open(os.path.join(self.directory, 'manifest.json'), encoding = 'utf8') as f:
+            data = json.load(f)
+        self.lyrics: list[str] = data['lyrics']
+        self.files: list[dict] = data['files']
+        self.chunks: list[str] = data['chunks']
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def chunk(self, idx: int) -> dict[str, np.ndarray]:
+        """
+        Memory-maps every array of a chunk.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the chunk.
+        """
+        path = os.path.join(self.directory, self.chunks[idx])
+        return {name[:-4]: np.load(os.path.join(path, name), mmap_mode = 'r')
+                for name in os.listdir(path) if name.endswith('.npy')}
+
+    def pitch(self, chunk: dict[str, np.ndarray], idx: int) -> np.ndarray:
+        """
+        Returns the pitch curve of a note in a chunk.
+
+        Parameters
+        ----------
+        chunk : dict of str to np.ndarray
+            The chunk. See chunk.
+
+        idx : int
+            The index of the note in the chunk.
+        """
+        offsets = chunk['pitch_offsets']
+        return chunk['pitch'][offsets[idx]:offsets[idx + 1]]
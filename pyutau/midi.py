@@ -0,0 +1,363 @@
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+import heapq
+import io
+import os
+import struct
+
+from pyutau.pyutau import Note, UtauPlugin, _format_float, create_note
+
+__all__ = [
+    'MidiEvent',
+    'iter_midi_events',
+    'iter_midi_notes',
+    'read_midi',
+    'write_midi'
+    ]
+
+class MidiEvent:
+    """
+    A class for the MIDI events that matter for USTs.
+
+    Attributes
+    ----------
+    tick : int
+        The absolute time of the event in MIDI ticks.
+
+    kind : str
+        'note_on', 'note_off', 'tempo' or 'lyric'.
+
+    track : int
+        The track the event is in.
+
+    channel : int or None
+        The channel of note events. None for meta events.
+
+    value : int, float or bytes
+        The note number for note events, the tempo in BPM for tempo events and the raw text for lyric events.
+    """
+    __slots__ = ('tick', 'kind', 'track', 'channel', 'value')
+
+    def __init__(self, tick: int, kind: str, track: int, channel: int | None, value: int | float | bytes):
+        self.tick: int = tick
+        self.kind: str = kind
+        self.track: int = track
+        self.channel: int | None = channel
+        self.value: int | float | bytes = value
+
+    def __repr__(self) -> str:
+        return f'MidiEvent({self.tick}, {self.kind!r}, {self.value!r})'
+
+def _read_vlq(data: bytes, pos: int) -> tuple[int, int]:
+    res = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        res = (res << 7) | (b & 0x7f)
+        if b < 0x80:
+            return res, pos
+
+def _write_vlq(value: int) -> bytes:
+    res = bytearray([value & 0x7f])
+    value >>= 7
+    while value:
+        res.append(0x80 | (value & 0x7f))
+        value >>= 7
+    return bytes(reversed(res))
+
+def _iter_track(data: bytes, start: int, end: int, track: int) -> Iterator[tuple[int, int, MidiEvent]]:
+    #Yields (tick, sequence, event) so heapq.merge keeps the order of events on the same tick.
+    pos = start
+    tick = 0
+    status = 0
+    seq = 0
+    while pos < end:
+        delta, pos = _read_vlq(data, pos)
+        tick += delta
+        b = data[pos]
+        if b & 0x80:
+            status = b
+            pos += 1
+        #Otherwise it's running status, and b is the first data byte.
+        if status == 0xff:
+            meta = data[pos]
+            length, pos = _read_vlq(data, pos + 1)
+            payload = data[pos:pos + length]
+            pos += length
+            if meta == 0x51 and length == 3:
+                bpm = 60000000 / int.from_bytes(payload, 'big')
+                yield tick, seq, MidiEvent(tick, 'tempo', track, None, bpm)
+            elif meta == 0x05:
+                yield tick, seq, MidiEvent(tick, 'lyric', track, None, payload)
+            elif meta == 0x2f:
+                return
+            status = 0
+        elif status in [0xf0, 0xf7]:
+            length, pos = _read_vlq(data, pos)
+            pos += length
+            status = 0
+        else:
+            kind = status & 0xf0
+            channel = status & 0x0f
+            if kind in [0xc0, 0xd0]:
+                pos += 1
+                continue
+            note, velocity = data[pos], data[pos + 1]
+            pos += 2
+            if kind == 0x90 and velocity > 0:
+                yield tick, seq, MidiEvent(tick, 'note_on', track, channel, note)
+            elif kind == 0x80 or kind == 0x90:
+                yield tick, seq, MidiEvent(tick, 'note_off', track, channel, note)
+            else:
+                continue
+        seq += 1
+
+def iter_midi_events(fpath: str | os.PathLike) -> tuple[int, Iterator[MidiEvent]]:
+    """
+    Reads the events of a standard MIDI file in time order. Tracks are decoded lazily and merged as they go.
+
+    Parameters
+    ----------
+    fpath : str or path-like
+        The path to the MIDI file.
+
+    Returns
+    -------
+    division : int
+        The number of MIDI ticks per quarter note.
+
+    events : iterator of MidiEvent
+        The note, tempo and lyric events of all tracks.
+    """
+    with open(fpath, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'MThd':
+        raise ValueError(f'Not a MIDI file: {os.fspath(fpath)}')
+    header_length, _, _, division = struct.unpack_from('>IHHH', data, 4)
+    if division & 0x8000:
+        raise ValueError('SMPTE time division is not supported')
+
+    tracks = []
+    pos = 8 + header_length
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        length = struct.unpack_from('>I', data, pos + 4)[0]
+        if chunk_id == b'MTrk':
+            tracks.append(_iter_track(data, pos + 8, min(pos + 8 + length, len(data)), len(tracks)))
+        pos += 8 + length
+
+    #Ties on the same tick go by track, then by order in the track.
+    merged = heapq.merge(*tracks, key = lambda x: (x[0], x[2].track, x[1]))
+    return division, (event for _, _, event in merged)
+
+def _decode_lyric(text: bytes, encoding: str | None) -> str:
+    if encoding:
+        return text.decode(encoding, errors = 'replace')
+    try:
+        return text.decode('utf-8')
+    except UnicodeDecodeError:
+        return text.decode('cp932', errors = 'replace')
+
+def iter_midi_notes(fpath: str | os.PathLike, track: int | None = None, channel: int | None = None,
+                    encoding: str | None = None, default_lyric: str = 'あ') -> Iterator[Note]:
+    """
+    Converts a MIDI file to UST notes as it is read.
+
+    Parameters
+    ----------
+    fpath : str or path-like
+        The path to the MIDI file.
+
+    track : int or None
+        Only reads notes from this track. Default is None, which reads all tracks.
+
+    channel : int or None
+        Only reads notes from this channel. Default is None, which reads all channels.
+
+    encoding : str or None
+        The encoding of the lyric events. Default is None, which tries UTF-8 then cp932.
+
+    default_lyric : str
+        The lyric of notes without a lyric event. Default is 'あ'.
+
+    Returns
+    -------
+    notes : iterator of Note
+        INSERT notes made with create_note. Gaps become rest notes with 'R' as the lyric.
+
+    Notes
+    -----
+    USTs are monophonic, so a note that starts while another is playing cuts the other one short.
+    Tempo changes are put on the next note that starts, since UST tempo is set per note.
+    """
+    division, events = iter_midi_events(fpath)
+    def to_ust(tick: int) -> int:
+        return round(tick * 480 / division)
+
+    cursor = 0 #End of the last note written, in UST ticks.
+    current = None #[start, note_num, lyric, has lyric event] of the playing note.
+    tempos = [] #(UST tick, bpm) of tempo changes that aren't on a note yet.
+    lyric = None
+    lyric_tick = -1
+
+    def make(lyric: str, start: int, end: int, note_num: int) -> Note:
+        note = create_note(lyric, end - start, note_num)
+        #The note gets the last change at or before its start. Later changes wait for a later note.
+        tempo = None
+        while tempos and tempos[0][0] <= start:
+            tempo = tempos.pop(0)[1]
+        if tempo != None:
+            note.set_tempo(tempo)
+        return note
+
+    for event in events:
+        if event.kind == 'tempo':
+            tempos.append((to_ust(event.tick), event.value))
+            continue
+        if track != None and event.track != track:
+            continue
+        if event.kind == 'lyric':
+            lyric = _decode_lyric(event.value, encoding)
+            lyric_tick = event.tick
+            #Lyrics usually come right before their note, but sometimes on the same tick after it.
+            if current and not current[3] and to_ust(event.tick) == current[0]:
+                current[2] = lyric
+                current[3] = True
+                lyric = None
+            continue
+        if channel != None and event.channel != channel:
+            continue
+
+        tick = to_ust(event.tick)
+        if event.kind == 'note_on':
+            if current:
+                if tick > current[0]:
+                    yield make(current[2], current[0], tick, current[1])
+                    cursor = tick
+                current = None
+            if tick > cursor:
+                yield make('R', cursor, tick, 60)
+                cursor = tick
+            current = [tick, event.value, default_lyric, False]
+            if lyric != None and lyric_tick <= event.tick:
+                current[2] = lyric
+                current[3] = True
+                lyric = None
+        elif current and event.value == current[1]:
+            if tick > current[0]:
+                yield make(current[2], current[0], tick, current[1])
+                cursor = tick
+            current = None
+
+    if current:
+        #Note without a note off. Give it a quarter note.
+        yield make(current[2], current[0], current[0] + 480, current[1])
+        cursor = current[0] + 480
+    if tempos:
+        #Tempo changes after the last note need a note to live on.
+        note = create_note('R', 480, 60)
+        note.set_tempo(tempos[-1][1])
+        yield note
+
+def read_midi(fpath: str | os.PathLike, track: int | None = None, channel: int | None = None,
+              encoding: str | None = None) -> UtauPlugin:
+    """
+    Converts a MIDI file to a UST.
+
+    Parameters
+    ----------
+    fpath : str or path-like
+        The path to the MIDI file.
+
+    track : int or None
+        Only reads notes from this track. Default is None, which reads all tracks.
+
+    channel : int or None
+        Only reads notes from this channel. Default is None, which reads all channels.
+
+    encoding : str or None
+        The encoding of the lyric events. Default is None, which tries UTF-8 then cp932.
+
+    Returns
+    -------
+    plugin : UtauPlugin
+        A full UST with the notes numbered from 0000. The tempo setting is the first tempo of the file, or 120.
+    """
+    plugin = UtauPlugin.from_bytes(b'')
+    plugin.version = 'UST Version1.2'
+    plugin.is_ust = True
+    plugin.notes = list(iter_midi_notes(fpath, track, channel, encoding))
+    #INSERT is for plugin return data. A saved project numbers its notes.
+    for i, note in enumerate(plugin.notes):
+        note.note_type = f'{i:04d}'
+    tempo = plugin.notes[0].get_tempo() if plugin.notes else None
+    plugin.settings['Tempo'] = _format_float(tempo if tempo != None else 120)
+    plugin.settings['Tracks'] = '1'
+    return plugin
+
+def write_midi(notes: UtauPlugin | Iterable[Note], fpath: str | os.PathLike, tempo: float | None = None,
+               channel: int = 0, velocity: int = 100, encoding: str = 'utf-8') -> None:
+    """
+    Writes notes as a format 0 MIDI file. DELETE notes are skipped and rest notes become gaps.
+
+    Parameters
+    ----------
+    notes : UtauPlugin or iterable of Note
+        The notes. A UtauPlugin also gives its tempo setting.
+
+    fpath : str or path-like
+        The path to write the MIDI file in.
+
+    tempo : float or None
+        The starting tempo. Default is None, which takes the tempo setting of the plugin, or 120.
+
+    channel : int
+        The channel of the notes. Default is 0.
+
+    velocity : int
+        The velocity of the notes. Default is 100.
+
+    encoding : str
+        The encoding of the lyric events. Default is 'utf-8'.
+    """
+    if isinstance(notes, UtauPlugin):
+        if tempo == None and notes.settings.get('Tempo'):
+            tempo = float(notes.settings['Tempo'])
+        notes = notes.notes
+    if tempo == None:
+        tempo = 120.0
+
+    track = io.BytesIO()
+    delta = 0
+    def event(data: bytes) -> None:
+        nonlocal delta
+        track.write(_write_vlq(delta))
+        track.write(data)
+        delta = 0
+
+    def tempo_event(bpm: float) -> None:
+        event(b'\xff\x51\x03' + round(60000000 / bpm).to_bytes(3, 'big'))
+
+    tempo_event(tempo)
+    for note in notes:
+        if note.is_deleted:
+            continue
+        if 'Tempo' in note.note_data and note.get_tempo() != tempo:
+            tempo = note.get_tempo()
+            tempo_event(tempo)
+        length = note.get_length()
+        lyric = note.get_lyric()
+        if not lyric or lyric.lower() == 'r':
+            delta += length
+            continue
+        text = lyric.encode(encoding, errors = 'replace')
+        event(b'\xff\x05' + _write_vlq(len(text)) + text)
+        event(bytes([0x90 | channel, note.get_note_num(), velocity]))
+        delta += length
+        event(bytes([0x80 | channel, note.get_note_num(), 0]))
+    event(b'\xff\x2f\x00')
+
+    with open(fpath, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, 480))
+        f.write(b'MTrk' + struct.pack('>I', track.tell()))
+        f.write(track.getbuffer())
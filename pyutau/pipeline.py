@@ -0,0 +1,180 @@
+from __future__ import annotations
+from collections.abc import Callable
+import os
+import time
+
+from pyutau.pyutau import UtauPlugin
+
+__all__ = [
+    'Stage',
+    'Pipeline'
+    ]
+
+#A transform changes the plugin in place, or returns the plugin to use from then on.
+Transform = Callable[[UtauPlugin], 'UtauPlugin | None']
+
+class Stage:
+    """
+    A class for one transform in a Pipeline.
+
+    Attributes
+    ----------
+    name : str
+        The name of the stage. Defaults to the name of the function.
+
+    func : callable
+        The transform. Takes the UtauPlugin and changes it in place, or returns a new UtauPlugin.
+
+    snapshot : bool
+        If a copy of the plugin is kept from before this stage runs.
+
+    seconds : float or None
+        How long the stage took in the last run. None if it hasn't run.
+    """
+    def __init__(self, func: Transform, name: str | None = None, snapshot: bool = False):
+        self.func: Transform = func
+        self.name: str = name or getattr(func, '__name__', None) or repr(func)
+        self.snapshot: bool = snapshot
+        self.seconds: float | None = None
+
+    def __repr__(self) -> str:
+        timing = f', {self.seconds * 1000:.2f} ms' if self.seconds != None else ''
+        return f'Stage({self.name!r}{timing})'
+
+class Pipeline:
+    """
+    A class that runs several transforms over one parsed UST, so it's only read and written once.
+
+    Attributes
+    ----------
+    stages : list of Stage
+        The stages in order.
+
+    plugin : UtauPlugin or None
+        The plugin of the last run. None if it hasn't run.
+
+    snapshots : dict of str to UtauPlugin
+        The copies of the plugin from before each stage that asked for one, by stage name.
+
+    Notes
+    -----
+    Stages with the same name share a snapshot, so give them different names if both need to be rolled back to.
+    If a stage raises, the plugin is rolled back to its snapshot when it has one, and the error is raised again.
+    """
+    def __init__(self, *funcs: Transform, snapshots: bool = False):
+        """
+        Makes a pipeline from transforms.
+
+        Parameters
+        ----------
+        *funcs : callable
+            The transforms in order.
+
+        snapshots : bool
+            If every stage keeps a snapshot. Default is False.
+        """
+        self.stages: list[Stage] = [Stage(func, snapshot = snapshots) for func in funcs]
+        self.plugin: UtauPlugin | None = None
+        self.snapshots: dict[str, UtauPlugin] = {}
+
+    def add(self, func: Transform, name: str | None = None, snapshot: bool = False) -> Pipeline:
+        """
+        Adds a transform to the end of the pipeline.
+
+        Parameters
+        ----------
+        func : callable
+            The transform. Takes the UtauPlugin and changes it in place, or returns a new UtauPlugin.
+
+        name : str or None
+            The name of the stage. Default is None, which is the name of the function.
+
+        snapshot : bool
+            If a copy of the plugin is kept from before this stage runs. Default is False.
+
+        Returns
+        -------
+        pipeline : Pipeline
+            This pipeline, so calls can be chained.
+        """
+        self.stages.append(Stage(func, name, snapshot))
+        return self
+
+    def run(self, plugin: UtauPlugin | str | os.PathLike, output: str | os.PathLike | None = None, **kwargs) -> UtauPlugin:
+        """
+        Runs every stage in order.
+
+        Parameters
+        ----------
+        plugin : UtauPlugin, str or path-like
+            The plugin data, or the path to the UST to read it from.
+
+        output : str, path-like or None
+            Where to write the result. Default is None, which doesn't write anything.
+            When plugin is a path, pass the same path to write it back like a plugin should.
+
+        **kwargs
+            Passed to UtauPlugin.write.
+
+        Returns
+        -------
+        plugin : UtauPlugin
+            The plugin after every stage.
+        """
+        if not isinstance(plugin, UtauPlugin):
+            plugin = UtauPlugin(plugin)
+        self.plugin = plugin
+        self.snapshots = {}
+        for stage in self.stages:
+            stage.seconds = None
+        for stage in self.stages:
+            if stage.snapshot:
+                self.snapshots[stage.name] = self.plugin.copy()
+            start = time.perf_counter()
+            try:
+                res = stage.func(self.plugin)
+            except Exception:
+                stage.seconds = time.perf_counter() - start
+                if stage.snapshot:
+                    self.rollback(stage.name)
+                raise
+            stage.seconds = time.perf_counter() - start
+            if isinstance(res, UtauPlugin):
+                self.plugin = res
+
+        if output != None:
+            self.plugin.write(output, **kwargs)
+        return self.plugin
+
+    def rollback(self, name: str) -> UtauPlugin:
+        """
+        Puts the plugin back to how it was before a stage. The snapshot is kept, so it can be rolled back to again.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+
+        Returns
+        -------
+        plugin : UtauPlugin
+            The plugin. It is changed in place, so anything holding it sees the rollback.
+        """
+        if name not in self.snapshots:
+            raise KeyError(f'No snapshot for stage {name!r}')
+        restored = self.snapshots[name].copy()
+        if self.plugin != None:
+            vars(self.plugin).clear()
+            vars(self.plugin).update(vars(restored))
+        else:
+            self.plugin = restored
+        return self.plugin
+
+    def timings(self) -> list[tuple[str, float | None]]:
+        """
+        Returns the name of each stage and how long it took in the last run, in seconds. Stages that didn't run are None.
+        """
+        return [(stage.name, stage.seconds) for stage in self.stages]
+
+    def __repr__(self) -> str:
+        return f'Pipeline({", ".join(stage.name for stage in self.stages)})'
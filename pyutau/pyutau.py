@@ -1,6 +1,12 @@
 from __future__ import annotations
+from array import array
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from concurrent.futures import Executor
+import asyncio
+import codecs
 import re
 import os
+import struct
 
 __all__ = [
     'Envelope',
@@ -9,9 +15,138 @@ __all__ = [
     'Vibrato',
     'Note',
     'UtauPlugin',
-    'create_note'
+    'Timeline',
+    'aload_many',
+    'create_note',
+    'detect_encoding'
     ]
 
+_SECTION = re.compile(r'\[#(.+)\]')
+_NEG_ZERO = struct.pack('d', -0.0)
+_CHARSET = re.compile(rb'^Charset=([^\r\n]*)', re.M)
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16')
+    ]
+
+#The Charset names UTAU knows, by codec name.
+_CHARSET_NAMES = {
+    'utf-8' : 'UTF-8',
+    'utf-8-sig' : 'UTF-8',
+    'cp932' : 'Shift_JIS',
+    'shift_jis' : 'Shift_JIS'
+}
+
+def _codec_name(encoding: str) -> str | None:
+    try:
+        return codecs.lookup(encoding.strip()).name
+    except LookupError:
+        return None
+
+def _charset_for(charset: str | None, encoding: str) -> str | None:
+    #Keeps the Charset line if it says the encoding the text is really in, otherwise swaps in the one that does.
+    #None if there was no Charset line, or UTAU has no name for the encoding.
+    if charset == None:
+        return None
+    name = _codec_name(encoding)
+    used = _CHARSET_NAMES.get(name, name)
+    said = _codec_name(charset)
+    if said != None and _CHARSET_NAMES.get(said, said) == used:
+        return charset
+    return _CHARSET_NAMES.get(name)
+
+def _decode(data: bytes, encoding: str | None = None) -> tuple[str, str]:
+    #Decodes once and returns the text with the encoding that worked.
+    if encoding:
+        return data.decode(encoding), encoding
+
+    for bom, name in _BOMS:
+        if data.startswith(bom):
+            return data.decode(name), name
+
+    #Charset is in the VERSION section, so it's always near the top.
+    charset = _CHARSET.search(data, 0, 4096)
+    if charset:
+        try:
+            name = codecs.lookup(charset.group(1).strip().decode('ascii')).name
+            return data.decode(name), name
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    #Plain ASCII is read the same either way, so keep UTAU's default for when it gets written back.
+    if data.isascii():
+        return data.decode('ascii'), 'cp932'
+
+    try:
+        return data.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        return data.decode('cp932', errors = 'replace'), 'cp932'
+
+#Number formatting. Every number is written with at most 3 decimals and no trailing zeros.
+def _format_float(x: float) -> str:
+    return f'{x:.3f}'.rstrip('0').rstrip('.')
+
+#Remembers formatted numbers. Pitch data uses the same few numbers over and over,
+#so most of a list can be looked up without leaving C.
+class _FloatStrings(dict):
+    def __missing__(self, x):
+        if len(self) >= 65536:
+            self.clear()
+        res = self[x] = _format_float(x)
+        return res
+
+_FLOAT_STRINGS = _FloatStrings()
+
+def _has_negative_zero(values: list) -> bool:
+    #-0.0 is the same key as 0.0 but is written as '-0', so look for its bytes at every 8th byte.
+    try:
+        buf = array('d', values).tobytes()
+    except TypeError:
+        return True
+    i = buf.find(_NEG_ZERO)
+    while i != -1:
+        if i % 8 == 0:
+            return True
+        i = buf.find(_NEG_ZERO, i + 1)
+    return False
+
+def _format_floats(values: Iterable[float]) -> str:
+    #Same as joining _format_float of every value with commas.
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    if _has_negative_zero(values):
+        return ','.join([_format_float(x) for x in values])
+    return ','.join(map(_FLOAT_STRINGS.__getitem__, values))
+
+def _parse_floats(values: str | Iterable[str | float]) -> list[float]:
+    #Blank entries are 0.
+    parts = values.split(',') if isinstance(values, str) else values
+    if '' in parts:
+        return [float(x) if x != '' else 0 for x in parts]
+    return list(map(float, parts))
+
+#Rests by lyric. Notes without a lyric aren't sung either.
+def _is_rest(lyric: str | None) -> bool:
+    return lyric in ['R', 'r', '', None]
+
+def detect_encoding(data: bytes) -> str:
+    """
+    Detects the encoding of UST data.
+
+    Parameters
+    ----------
+    data : bytes
+        The raw UST data.
+
+    Returns
+    -------
+    encoding : str
+        The encoding. A BOM is checked first, then the Charset setting, then if the data is valid UTF-8.
+        Anything else is cp932, the Windows version of Shift-JIS that UTAU uses.
+    """
+    return _decode(data)[1]
+
 #Envelope class. Largely based on how Delta stores Envelope data.
 class Envelope:
     """
@@ -79,12 +214,12 @@ class Envelope:
 
     def __str__(self) -> str:
         '''Unparses the envelope data to a string.'''
-        res = [f'{x:.3f}'.rstrip('0').rstrip('.') for x in [*self.p[:3], *self.v[:4]]]
+        res = _format_floats([*self.p[:3], *self.v[:4]])
         if len(self.p) >= 4:
-            res.extend(['%', f'{self.p[3]:.3f}'.rstrip('0').rstrip('.')])
+            res += ',%,' + _format_float(self.p[3])
         if len(self.p) == 5:
-            res.extend([f'{x:.3f}'.rstrip('0').rstrip('.') for x in [self.p[4], self.v[4]]])
-        return ','.join(res)
+            res += ',' + _format_floats([self.p[4], self.v[4]])
+        return res
 
     def get(self) -> str:
         '''Unparses the envelope data to a string.'''
@@ -120,7 +255,7 @@ class Mode1Pitch:
             The data in PitchBend. Default is '', which is interpreted as [0].
         """
         self.start_time: float | None = None if PBStart == '' else float(PBStart)
-        self.pitches: list[float] = [float(x) if x != '' else 0 for x in PitchBend.split(',')]
+        self.pitches: list[float] = _parse_floats(PitchBend)
 
     def set_pitches(self, *args: float | str) -> None:
         """
@@ -131,11 +266,11 @@ class Mode1Pitch:
         *args : float or str
             The pitchbend points.
         """
-        self.pitches = [float(x) if x != '' else 0 for x in args]
+        self.pitches = _parse_floats(args)
 
     def get_pitches(self) -> str:
         '''Unparses the pitchbend points to a string.'''
-        return ','.join([f'{x:.3f}'.rstrip('0').rstrip('.') for x in self.pitches])
+        return _format_floats(self.pitches)
 
     def set_start_time(self, PBStart: float | str) -> None:
         """
@@ -150,7 +285,7 @@ class Mode1Pitch:
 
     def get_start_time(self) -> str:
         '''Unparses the pitchbend start time to a string.'''
-        return f'{self.start_time:.3f}'.rstrip('0').rstrip('.') if self.start_time != None else ''
+        return _format_float(self.start_time) if self.start_time != None else ''
 
     def get(self) -> dict[str, str]:
         '''Unparses all the data needed for Mode1 pitchbends into a dictionary.'''
@@ -212,8 +347,8 @@ class Mode2Pitch:
         self.start_pitch: float = 0
         if len(pbst) == 2:
             self.start_pitch = 0 if pbst[1] == '' else float(pbst[1])
-        self.pbw: list[float] = [float(x) if x != '' else 0 for x in PBW.split(',')]
-        self.pby: list[float] = [float(x) if x != '' else 0 for x in PBY.split(',')]
+        self.pbw: list[float] = _parse_floats(PBW)
+        self.pby: list[float] = _parse_floats(PBY)
         self.pbm: list[str] = PBM.split(',')
 
     #TODO: Add append and extend for PBW, PBY, PBM maybe.
@@ -236,9 +371,9 @@ class Mode2Pitch:
     def get_pbs(self) -> str:
         '''Unparses the data needed for PBS into a string.'''
         if self.start_pitch == 0:
-            return f'{self.start_time:.3f}'.rstrip('0').rstrip('.')
+            return _format_float(self.start_time)
         else:
-            return f'{self.start_time:.3f}'.rstrip('0').rstrip('.') + f';{self.start_pitch:.3f}'.rstrip('0').rstrip('.')
+            return _format_float(self.start_time) + ';' + _format_float(self.start_pitch)
 
     def set_pbw(self, *args: float | str) -> None:
         """
@@ -249,11 +384,11 @@ class Mode2Pitch:
         *args : float or str
             The list of intervals between control points in milliseconds.
         """
-        self.pbw = [float(x) if x != '' else 0 for x in args]
+        self.pbw = _parse_floats(args)
 
     def get_pbw(self) -> str:
         '''Unparses the data needed for PBW into a string.'''
-        return ','.join([f'{x:.3f}'.rstrip('0').rstrip('.') for x in self.pbw])
+        return _format_floats(self.pbw)
 
     def set_pby(self, *args: float | str) -> None:
         """
@@ -264,11 +399,11 @@ class Mode2Pitch:
         *args : float or str
             The list of pitch offsets for each control point.
         """
-        self.pby = [float(x) if x != '' else 0 for x in args]
+        self.pby = _parse_floats(args)
 
     def get_pby(self) -> str:
         '''Unparses the data needed for PBY into a string.'''
-        return ','.join([f'{x:.3f}'.rstrip('0').rstrip('.') for x in self.pby])
+        return _format_floats(self.pby)
 
     def set_pbm(self, *args: str):
         """
@@ -336,7 +471,7 @@ class Vibrato:
         VBR : str
             The data in VBR. Default is '', which is interpreted as '65, 180, 35, 20, 20, 0, 0'.
         """
-        tmp = [float(x) if x != '' else 0 for x in VBR.split(',')]
+        tmp = _parse_floats(VBR)
         if len(tmp) < 7:
             tmp = [65, 180, 35, 20, 20, 0, 0]
         self.length: float = tmp[0]
@@ -385,7 +520,7 @@ class Vibrato:
     def __str__(self):
         '''Unparses the data needed for VBR into a string.'''
         tmp = [self.length, self.cycle, self.depth, self.fade_in, self.fade_out, self.phase, self.offset]
-        return ','.join([f'{x:.3f}'.rstrip('0').rstrip('.') for x in tmp]) + ',0'
+        return _format_floats(tmp) + ',0'
 
     def get(self):
         '''Unparses the data needed for VBR into a string.'''
@@ -396,6 +531,42 @@ class Vibrato:
         return Vibrato(self.get())
     
 
+#Dictionary that counts its changes. Lets Note know when its cached text is out of date.
+class _NoteData(dict):
+    version = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
+
+    def setdefault(self, key, default = None):
+        self.version += 1
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
 #Note class. Biggest class of all. Stores note data with corresponding classes for "special" data.
 class Note:
     """
@@ -411,6 +582,12 @@ class Note:
     
     note_data : dict[str, str or None]
         Where all note data is stored. Blank entries are written as None. Only put string keys and values here.
+
+    Notes
+    -----
+    The unparsed note is cached, and is only remade when note_data, note_type or is_deleted changes.
+    A dict assigned to note_data is kept as is, not copied. Notes made here count the changes to their note_data,
+    so checking the cache is cheap, while a plain dict has its items compared every time.
     """
     def __init__(self, note_type: str = 'INSERT'):
         """
@@ -426,19 +603,40 @@ class Note:
         #In case it's needed to bring back a delete note... I don't even know if anyone needs it at all.
         #Not writing a function just to set this back to False. Just keep in mind when you're reading this.
         self.is_deleted: bool = False
+        self._cache: tuple[tuple, str] | None = None
         #Needed note data. Intensity and Modulation are just preferences.
-        self.note_data: dict[str, str | None] = {
+        self.note_data: dict[str, str | None] = _NoteData({
             'Length' : '480',
             'Lyric' : 'あ',
             'NoteNum' : '60',
             'PreUtterance' : None
-        }
+        })
+
+    #Whatever dictionary is given is kept as is, so the caller can still change it.
+    @property
+    def note_data(self) -> dict[str, str | None]:
+        return self._note_data
+
+    @note_data.setter
+    def note_data(self, note_data: dict[str, str | None]) -> None:
+        self._note_data = note_data
+        self._cache = None
+
+    def _state(self) -> tuple:
+        #What the cached text depends on. Plain dicts can't count their changes, so their items are compared instead.
+        data = self._note_data
+        version = data.version if isinstance(data, _NoteData) else tuple(data.items())
+        return (version, self.note_type, self.is_deleted)
     
     def copy(self) -> Note:
         '''Returns a deep copy of the note.'''
         res = Note(self.note_type)
         res.is_deleted = self.is_deleted
-        res.set_multiple_data(**self.note_data)
+        #Not set_multiple_data, since that turns blank entries into 'None'.
+        res.note_data = _NoteData(self.note_data)
+        #Same data, same text. Saves copies from unparsing again.
+        if self._cache and self._cache[0] == self._state():
+            res._cache = (res._state(), self._cache[1])
         return res
 
     #Clears all properties except essential ones
@@ -515,14 +713,15 @@ class Note:
     #For converting the Note class back to UTAU formatting
     def __str__(self) -> str:
         '''Unparses the note to a string.'''
-        string = f'[#{self.note_type}]\n' if not self.is_deleted else '[#DELETE]\n'
-        for k, v in self.note_data.items():
-            string += f'{k}='
-            if v:
-                string += f'{v}\n'
-            else:
-                string += '\n'
-
+        key = self._state()
+        if self._cache and self._cache[0] == key:
+            return self._cache[1]
+
+        lines = [f'[#{self.note_type}]\n' if not self.is_deleted else '[#DELETE]\n']
+        for k, v in self._note_data.items():
+            lines.append(f'{k}={v}\n' if v else f'{k}=\n')
+        string = ''.join(lines)
+        self._cache = (key, string)
         return string
 
     def get(self) -> str:
@@ -568,7 +767,7 @@ class Note:
         #Some might prefer using decimals.
         #This isn't as elegant as {preutterance:.3g} but it switches to e when needed
         #I also know this truncates preutterance to 3 decimals but... Come on...
-        self.note_data['PreUtterance'] = f'{preutterance:.3f}'.rstrip('0').rstrip('.')
+        self.note_data['PreUtterance'] = _format_float(preutterance)
 
     def get_preutterance(self) -> float | None:
         '''The note's pre-utterance in milliseconds.'''
@@ -590,7 +789,7 @@ class Note:
 
     #The following setters and getters are optional note data, and must be checked if present.
     def set_overlap(self, overlap: float) -> None:
-        self.note_data['VoiceOverlap'] = f'{overlap:.3f}'.rstrip('0').rstrip('.')
+        self.note_data['VoiceOverlap'] = _format_float(overlap)
 
     def get_overlap(self) -> float | None:
         '''The note's overlap in milliseconds.'''
@@ -607,7 +806,7 @@ class Note:
         self.note_data['VoiceOverlap'] = self.note_data['@overlap']
 
     def set_intensity(self, intensity: float) -> None:
-        self.note_data['Intensity'] = f'{intensity:.3f}'.rstrip('0').rstrip('.')
+        self.note_data['Intensity'] = _format_float(intensity)
 
     def get_intensity(self) -> float | None:
         '''The note's intensity in percent.'''
@@ -619,7 +818,7 @@ class Note:
     intensity = property(get_intensity, set_intensity)
 
     def set_modulation(self, modulation: float) -> None:
-        self.note_data['Modulation'] = f'{modulation:.3f}'.rstrip('0').rstrip('.')
+        self.note_data['Modulation'] = _format_float(modulation)
 
     def get_modulation(self) -> float | None:
         '''The note's modulation in percent.'''
@@ -631,7 +830,7 @@ class Note:
     modulation = property(get_modulation, set_modulation)
 
     def set_start_point(self, start_point: float) -> None:
-        self.note_data['StartPoint'] = f'{start_point:.3f}'.rstrip('0').rstrip('.')
+        self.note_data['StartPoint'] = _format_float(start_point)
 
     def get_start_point(self) -> float | None:
         '''The note's start point/offset in milliseconds. The offset is relative to the offset of the oto.'''
@@ -661,7 +860,7 @@ class Note:
     envelope = property(get_envelope, set_envelope)
 
     def set_tempo(self, tempo: float) -> None:
-        self.note_data['Tempo'] = f'{tempo:.3f}'.rstrip('0').rstrip('.')
+        self.note_data['Tempo'] = _format_float(tempo)
 
     def get_tempo(self) -> float | None:
         '''The tempo at this note.'''
@@ -673,7 +872,7 @@ class Note:
     tempo = property(get_tempo, set_tempo)
 
     def set_velocity(self, velocity: float) -> None:
-        self.note_data['Velocity'] = f'{velocity:.3f}'.rstrip('0').rstrip('.')
+        self.note_data['Velocity'] = _format_float(velocity)
 
     def get_velocity(self) -> float | None:
         '''The note's consonant velocity.'''
@@ -852,8 +1051,18 @@ class UtauPlugin:
 
     is_ust : bool
         If the parsed UST is the plugin format or not.
+
+    encoding : str
+        The encoding the UST was read in. Used again when writing.
+
+    charset : str or None
+        The Charset line of the VERSION section. None if not provided. If the data couldn't be decoded with it,
+        it's replaced with the name of the encoding that was used, or None if UTAU has no name for it.
+
+    invalid_lines : list of tuple of int and str
+        The line number and text of setting and note lines without '='. These are skipped.
     """
-    def __init__(self, fpath: str | os.PathLike, encoding: str = 'shiftjis'):
+    def __init__(self, fpath: str | os.PathLike, encoding: str | None = None):
         """
         Initializes and parses the UST given.
 
@@ -862,20 +1071,46 @@ class UtauPlugin:
         fpath : str or path-like
             The path to the UST.
         
-        encoding : str
-            The encoding of the UST. Defaults to 'shiftjis'
+        encoding : str or None
+            The encoding of the UST. Defaults to None, which detects it. See detect_encoding.
         """
-        data_string = open(fpath, encoding = encoding).readlines()
+        with open(fpath, 'rb') as f:
+            data = f.read()
+        self._parse(data, encoding)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, encoding: str | None = None) -> UtauPlugin:
+        """
+        Parses UST data that is already in memory.
+
+        Parameters
+        ----------
+        data : bytes
+            The raw UST data.
+
+        encoding : str or None
+            The encoding of the UST. Defaults to None, which detects it. See detect_encoding.
+        """
+        res = cls.__new__(cls)
+        res._parse(data, encoding)
+        return res
+
+    def _parse(self, data: bytes, encoding: str | None) -> None:
+        text, self.encoding = _decode(data, encoding)
         phase = 0
         self.settings: dict = {}
         self.prev_note: Note | None = None
         self.next_note: Note | None = None
         self.version: str | None = None
+        self.charset: str | None = None
         self.notes: list[Note] = []
         self.is_ust: bool = False
+        self.invalid_lines: list[tuple[int, str]] = []
         #I'm sorry if you're disgusted by this parsing. Even if rewritten, my statement still holds.
-        for line in data_string:
-            sectionMatch = re.match('\[#(.+)\]', line)
+        for i, line in enumerate(text.replace('\r\n', '\n').split('\n'), 1):
+            if not line:
+                continue
+            sectionMatch = _SECTION.match(line)
             if sectionMatch:
                 sectionName = sectionMatch.group(1)
                 if sectionName == 'VERSION':
@@ -891,13 +1126,20 @@ class UtauPlugin:
                 continue
             
             if phase == 1:
-                self.version = line[:-1]
-            elif phase == 2:
-                setStr = line.split('=')
-                self.settings[setStr[0]] = setStr[1][:-1]
-            elif phase == 3:
-                setStr = line.split('=')
-                self.notes[-1].set_custom_data(setStr[0], setStr[1][:-1])
+                if line.startswith('Charset='):
+                    #A Charset that the data couldn't be decoded with isn't kept.
+                    self.charset = _charset_for(line[8:], self.encoding)
+                else:
+                    self.version = line
+            elif phase == 2 or phase == 3:
+                key, sep, value = line.partition('=')
+                if not sep:
+                    #Don't let one broken line stop the whole file from being read.
+                    self.invalid_lines.append((i, line))
+                elif phase == 2:
+                    self.settings[key] = value
+                else:
+                    self.notes[-1].set_custom_data(key, value)
 
         if self.notes:
             if self.notes[0].get_note_type() == 'PREV':
@@ -950,24 +1192,35 @@ class UtauPlugin:
                 notes.append(note)
         return notes
 
+    def copy(self) -> UtauPlugin:
+        '''Returns a deep copy of the plugin data.'''
+        res = UtauPlugin.__new__(type(self))
+        vars(res).update(vars(self))
+        res.settings = dict(self.settings)
+        res.prev_note = self.prev_note.copy() if self.prev_note else None
+        res.next_note = self.next_note.copy() if self.next_note else None
+        res.notes = [note.copy() for note in self.notes]
+        res.invalid_lines = list(self.invalid_lines)
+        return res
+
     def __str__(self) -> str:
         '''Unparses the whole class to a string for writing as a UST.'''
-        string = ''
+        #Notes cache their own text, so this mostly just joins them.
+        parts = []
         if self.prev_note:
-            string += str(self.prev_note)
+            parts.append(str(self.prev_note))
 
-        for note in self.notes:
-            string += str(note)
+        parts.extend(map(str, self.notes))
 
         if self.next_note:
-            string += str(self.next_note)
+            parts.append(str(self.next_note))
         
         if self.is_ust:
-            string += '[#TRACKEND]'
+            parts.append('[#TRACKEND]')
 
-        return string
+        return ''.join(parts)
 
-    def write(self, fpath : str | os.PathLike, encoding: str = 'shiftjis', with_header: bool = False) -> None:
+    def write(self, fpath : str | os.PathLike, encoding: str | None = None, with_header: bool = False) -> None:
         """
         Writes the UST data to the given file path.
 
@@ -976,18 +1229,345 @@ class UtauPlugin:
         fpath : str or path-like
             The path to write the UST in.
 
-        encoding : str
-            The encoding used. Default is 'shiftjis'
+        encoding : str or None
+            The encoding used. Default is None, which is the encoding the UST was read in.
+            The Charset line is changed to match it.
 
         with_header : bool
             If the header is written or not. If self.is_ust is true, the header is always written. Default is false.
         """
+        encoding = encoding or self.encoding
         with open(fpath, 'w', encoding = encoding) as f:
             if with_header or self.is_ust:
                 f.write('[#VERSION]\n')
                 f.write(self.version + '\n')
+                #UTAU goes by the Charset line, so it has to say the encoding that's really used.
+                charset = _charset_for(self.charset, encoding)
+                if charset != None:
+                    f.write(f'Charset={charset}\n')
                 f.write('[#SETTING]\n')
                 for k, v in self.settings.items():
                     f.write(f'{k}={v}\n')
 
             f.write(str(self))
+
+    @classmethod
+    async def aload(cls, fpath: str | os.PathLike, encoding: str | None = None, executor: Executor | None = None) -> UtauPlugin:
+        """
+        Reads and parses a UST without blocking the event loop.
+
+        Parameters
+        ----------
+        fpath : str or path-like
+            The path to the UST.
+
+        encoding : str or None
+            The encoding of the UST. Defaults to None, which detects it. See detect_encoding.
+
+        executor : Executor or None
+            Where the reading and parsing is done. Default is None, which is the default executor of the event loop.
+
+        Notes
+        -----
+        Reading and parsing happen in one call in the executor, so a file only makes one trip. Parsing holds the GIL,
+        so a ProcessPoolExecutor is what gets many files parsed at the same time. Threads only overlap the reading.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, cls, os.fspath(fpath), encoding)
+
+    async def awrite(self, fpath: str | os.PathLike, encoding: str | None = None, with_header: bool = False,
+                     executor: Executor | None = None) -> None:
+        """
+        Writes the UST data without blocking the event loop. See write.
+
+        Parameters
+        ----------
+        fpath : str or path-like
+            The path to write the UST in.
+
+        encoding : str or None
+            The encoding used. Default is None, which is the encoding the UST was read in.
+
+        with_header : bool
+            If the header is written or not. If self.is_ust is true, the header is always written. Default is false.
+
+        executor : Executor or None
+            Where the writing is done. Default is None, which is the default executor of the event loop.
+
+        Notes
+        -----
+        The plugin shouldn't be changed until this is done. With a ProcessPoolExecutor, it is copied when this is called.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self.write, os.fspath(fpath), encoding, with_header)
+
+async def aload_many(paths: Iterable[str | os.PathLike] | AsyncIterable[str | os.PathLike], encoding: str | None = None,
+                     limit: int = 8, executor: Executor | None = None,
+                     return_exceptions: bool = False) -> AsyncIterator[tuple[str, UtauPlugin | Exception]]:
+    """
+    Reads and parses many USTs with at most limit of them in flight at once.
+
+    Parameters
+    ----------
+    paths : iterable or async iterable of str or path-like
+        The USTs. Paths are only taken as there is room, so this can be a never-ending queue.
+
+    encoding : str or None
+        The encoding of the USTs. Defaults to None, which detects it for each file.
+
+    limit : int
+        The most files being read at once. Default is 8.
+
+    executor : Executor or None
+        Where the reading and parsing is done. Default is None, which is the default executor of the event loop.
+        Use a ProcessPoolExecutor to parse on more than one core.
+
+    return_exceptions : bool
+        If files that couldn't be read are yielded with their exception instead of raising it. Default is False.
+
+    Returns
+    -------
+    results : async iterator of tuple of str and UtauPlugin
+        The path and plugin of each UST, in the order they finish.
+
+    Notes
+    -----
+    Files that haven't finished are cancelled when the iterator is closed early. Files already running in a worker
+    still finish there, but their results are dropped.
+    """
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    loop = asyncio.get_running_loop()
+    if isinstance(paths, AsyncIterable):
+        queue = aiter(paths)
+    else:
+        queue = _aiter(paths)
+
+    pending = {}
+    exhausted = False
+    try:
+        while True:
+            #Keep the pool full before waiting on anything.
+            while not exhausted and len(pending) < limit:
+                try:
+                    fpath = os.fspath(await anext(queue))
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending[loop.run_in_executor(executor, UtauPlugin, fpath, encoding)] = fpath
+            if not pending:
+                break
+
+            done, _ = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+            for future in done:
+                fpath = pending.pop(future)
+                error = future.exception()
+                if error == None:
+                    yield fpath, future.result()
+                elif return_exceptions and isinstance(error, Exception):
+                    yield fpath, error
+                else:
+                    raise error
+    finally:
+        for future in pending:
+            future.cancel()
+
+async def _aiter(items: Iterable) -> AsyncIterator:
+    for x in items:
+        yield x
+
+#Note data as numbers for timing. Notes without a sample can't be rendered, so they time like rests.
+def _is_silent(note: Note | None) -> bool:
+    return not note or _is_rest(note.note_data.get('Lyric')) or '@filename' not in note.note_data
+
+def _first_float(note: Note, *keys: str, default: float = 0) -> float:
+    #Returns the first key that has a value. Put what UTAU calculated first to prefer it.
+    for k in keys:
+        v = note.note_data.get(k)
+        if v:
+            return float(v)
+    return default
+
+def _timing_preutterance(note: Note | None) -> float:
+    return 0 if _is_silent(note) else _first_float(note, '@preuttr', 'PreUtterance')
+
+def _timing_overlap(note: Note | None) -> float:
+    return 0 if _is_silent(note) else _first_float(note, '@overlap', 'VoiceOverlap')
+
+#Timeline class. Figures out where every note actually lands, since notes only know their own length.
+class Timeline:
+    """
+    A class that stores the position of every note in a UtauPlugin. DELETE notes are skipped.
+
+    Attributes
+    ----------
+    notes : list of Note
+        The notes that are not DELETE notes, in order.
+
+    prev_note : Note or None
+        The note that precedes the first note. Same as UtauPlugin.prev_note.
+
+    next_note : Note or None
+        The note that succeeds the last note. Same as UtauPlugin.next_note.
+
+    ticks : list of int
+        The onset of each note in ticks, relative to the first note. 480 = 1 quarter note.
+
+    lengths : list of int
+        The length of each note in ticks.
+
+    tempos : list of float
+        The tempo in effect at each note.
+
+    ms : list of float
+        The onset of each note in milliseconds, relative to the first note.
+
+    ms_lengths : list of float
+        The length of each note in milliseconds.
+
+    end_tick : int
+        The end of the last note in ticks.
+
+    end_ms : float
+        The end of the last note in milliseconds.
+    """
+    def __init__(self, plugin: UtauPlugin, tempo: float | None = None):
+        """
+        Calculates the positions of the notes in the plugin.
+
+        Parameters
+        ----------
+        plugin : UtauPlugin
+            The plugin data.
+
+        tempo : float or None
+            The tempo before the first note. Default is None, which takes the tempo from
+            the PREV note, then the Tempo setting, then falls back to 120.
+        """
+        if tempo == None and plugin.prev_note:
+            tempo = plugin.prev_note.get_tempo()
+        if tempo == None and plugin.settings.get('Tempo'):
+            tempo = float(plugin.settings['Tempo'])
+        if tempo == None:
+            tempo = 120.0
+
+        self.notes: list[Note] = plugin.get_notes()
+        self.prev_note: Note | None = plugin.prev_note
+        self.next_note: Note | None = plugin.next_note
+        self.ticks: list[int] = []
+        self.lengths: list[int] = []
+        self.tempos: list[float] = []
+        self.ms: list[float] = []
+        self.ms_lengths: list[float] = []
+
+        tick = 0
+        ms = 0.0
+        for note in self.notes:
+            if 'Tempo' in note.note_data:
+                tempo = note.get_tempo()
+            length = note.get_length()
+            ms_length = length * 125 / tempo #60000 / (tempo * 480)
+            self.ticks.append(tick)
+            self.lengths.append(length)
+            self.tempos.append(tempo)
+            self.ms.append(ms)
+            self.ms_lengths.append(ms_length)
+            tick += length
+            ms += ms_length
+
+        self.end_tick: int = tick
+        self.end_ms: float = ms
+
+    def __len__(self) -> int:
+        return len(self.notes)
+
+    def get_prev(self, idx: int) -> Note | None:
+        """
+        Returns the note before the note at the given index, including the PREV note.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the note.
+        """
+        return self.notes[idx - 1] if idx > 0 else self.prev_note
+
+    def get_next(self, idx: int) -> Note | None:
+        """
+        Returns the note after the note at the given index, including the NEXT note.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the note.
+        """
+        return self.notes[idx + 1] if idx + 1 < len(self.notes) else self.next_note
+
+    def is_silent(self, idx: int) -> bool:
+        """
+        Checks if the note at the given index is rendered as silence. This is rest notes and notes without @filename.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the note.
+        """
+        return _is_silent(self.notes[idx])
+
+    def preutterance(self, idx: int) -> float:
+        """
+        Returns how early the sample of the note at the given index starts in milliseconds. 0 for rests.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the note.
+
+        Notes
+        -----
+        @preuttr, which UTAU calculated, is used over PreUtterance.
+        """
+        return _timing_preutterance(self.notes[idx])
+
+    def overlap(self, idx: int) -> float:
+        """
+        Returns how much the note at the given index fades into the note before it in milliseconds. 0 for rests.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the note.
+
+        Notes
+        -----
+        @overlap, which UTAU calculated, is used over VoiceOverlap.
+        """
+        return _timing_overlap(self.notes[idx])
+
+    def start_point(self, idx: int) -> float:
+        """
+        Returns how much is cut from the start of the rendered note at the given index in milliseconds.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the note.
+        """
+        return _first_float(self.notes[idx], '@stpoint', 'StartPoint')
+
+    def correction(self, idx: int) -> float:
+        """
+        Returns how much longer the rendered note at the given index is than the note in milliseconds.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the note.
+
+        Notes
+        -----
+        The note gets longer by its own pre-utterance, and shorter by how much the next note starts early.
+        The NEXT note counts for the last note.
+        """
+        nxt = self.get_next(idx)
+        return _timing_preutterance(self.notes[idx]) - _timing_preutterance(nxt) + _timing_overlap(nxt)
@@ -0,0 +1,591 @@
+from __future__ import annotations
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import TYPE_CHECKING
+
+from pyutau.pyutau import Envelope, Note, UtauPlugin, Timeline, _first_float, _format_float, _is_rest
+
+if TYPE_CHECKING:
+    from pyutau.cache import RenderCache
+
+__all__ = [
+    'ResamplerJob',
+    'WavtoolJob',
+    'RenderProgress',
+    'RenderPipeline',
+    'pitch_curve',
+    'encode_pitchbend',
+    'note_name'
+    ]
+
+_B64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+_NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+def note_name(note_num: int) -> str:
+    """
+    Converts a NoteNum to the note name resamplers take. C4 = 60.
+
+    Parameters
+    ----------
+    note_num : int
+        The note's pitch.
+    """
+    return f'{_NOTE_NAMES[note_num % 12]}{note_num // 12 - 1}'
+
+#Curve shapes for Mode2 pitchbends. x goes from 0 to 1.
+def _curve(shape: str, x: float) -> float:
+    if shape == 's':
+        return x
+    elif shape == 'r':
+        return math.sin(x * math.pi / 2)
+    elif shape == 'j':
+        return 1 - math.cos(x * math.pi / 2)
+    else:
+        return (1 - math.cos(x * math.pi)) / 2
+
+def pitch_curve(note: Note, times: Sequence[float], prev_note: Note | None = None, tempo: float = 120) -> list[float]:
+    """
+    Samples the pitchbend of a note in cents, relative to the note's NoteNum.
+
+    Parameters
+    ----------
+    note : Note
+        The note.
+
+    times : sequence of float
+        The times to sample in milliseconds, relative to the start of the note.
+
+    prev_note : Note or None
+        The note before this one. Mode2 pitchbends start from its pitch unless PBS says otherwise.
+
+    tempo : float
+        The tempo at the note. Only used for Mode1 pitchbends. Default is 120.
+
+    Returns
+    -------
+    pitches : list of float
+        The pitch offset in cents at each time.
+
+    Notes
+    -----
+    Uses Mode2 data if the note has PBS, otherwise Mode1 data if the note has PitchBend.
+    Vibrato is added for Mode2 pitchbends.
+    """
+    res = [0.0] * len(times)
+    mode2 = note.get_mode2pitch()
+    if mode2:
+        #Control points. The first one is the previous note's pitch unless PBS has the start pitch.
+        start = mode2.start_pitch * 10
+        if len(note.note_data['PBS'].split(';')) < 2:
+            start = 0.0
+            if prev_note and not _is_rest(prev_note.note_data.get('Lyric')):
+                start = (prev_note.get_note_num() - note.get_note_num()) * 100.0
+        xs = [mode2.start_time]
+        ys = [start]
+        for i, w in enumerate(mode2.pbw):
+            xs.append(xs[-1] + w)
+            ys.append(mode2.pby[i] * 10 if i < len(mode2.pby) else 0.0)
+
+        j = 0
+        for i, t in enumerate(times):
+            if t <= xs[0]:
+                res[i] = ys[0]
+                continue
+            while j + 1 < len(xs) and xs[j + 1] < t:
+                j += 1
+            if j + 1 >= len(xs):
+                res[i] = ys[-1]
+                continue
+            width = xs[j + 1] - xs[j]
+            x = (t - xs[j]) / width if width else 1
+            shape = mode2.pbm[j] if j < len(mode2.pbm) else ''
+            res[i] = ys[j] + (ys[j + 1] - ys[j]) * _curve(shape, x)
+
+        vibrato = note.get_vibrato()
+        if vibrato and vibrato.length > 0 and vibrato.cycle > 0:
+            length = note.get_length() * 125 / tempo
+            vbr_length = length * vibrato.length / 100
+            vbr_start = length - vbr_length
+            fade_in = vbr_length * vibrato.fade_in / 100
+            fade_out = vbr_length * vibrato.fade_out / 100
+            for i, t in enumerate(times):
+                if t < vbr_start or t > length:
+                    continue
+                x = t - vbr_start
+                fade = 1.0
+                if fade_in and x < fade_in:
+                    fade = x / fade_in
+                if fade_out and length - t < fade_out:
+                    fade = min(fade, (length - t) / fade_out)
+                wave = math.sin(2 * math.pi * (x / vibrato.cycle + vibrato.phase / 100))
+                res[i] += fade * vibrato.depth * (wave + vibrato.offset / 100)
+        return res
+
+    mode1 = note.get_mode1pitch()
+    if mode1:
+        #Mode1 points are 5 ticks apart starting from PBStart.
+        step = 5 * 125 / tempo
+        start = mode1.start_time if mode1.start_time != None else 0
+        pitches = mode1.pitches
+        for i, t in enumerate(times):
+            k = round((t - start) / step)
+            res[i] = pitches[min(max(k, 0), len(pitches) - 1)]
+    return res
+
+def encode_pitchbend(pitches: Sequence[float]) -> str:
+    """
+    Encodes pitchbend points in cents to the base64 format that resamplers take.
+
+    Parameters
+    ----------
+    pitches : sequence of float
+        The pitchbend points in cents.
+
+    Notes
+    -----
+    Each point is a 12-bit two's complement number written as two base64 digits.
+    Repeated points are written once followed by #n#, where n is the number of repeats.
+    """
+    res = []
+    prev = None
+    repeat = 0
+    for x in pitches:
+        v = min(max(int(round(x)), -2048), 2047)
+        if v == prev:
+            repeat += 1
+            continue
+        if repeat:
+            res.append(f'#{repeat}#')
+            repeat = 0
+        u = v + 4096 if v < 0 else v
+        res.append(_B64[u >> 6] + _B64[u & 63])
+        prev = v
+    if repeat:
+        res.append(f'#{repeat}#')
+    return ''.join(res)
+
+class ResamplerJob:
+    """
+    A class for the arguments of one resampler call.
+
+    Attributes
+    ----------
+    index : int
+        The index of the note in the Timeline.
+
+    note : Note
+        The note being rendered.
+
+    input_file : str
+        The sample file.
+
+    output_file : str
+        Where the resampler writes the rendered note.
+
+    note_num : int
+        The note's pitch. C4 = 60.
+
+    velocity : float
+        The consonant velocity.
+
+    flags : str
+        The resampler flags.
+
+    offset : float
+        The offset of the sample in milliseconds.
+
+    length : float
+        The requested length in milliseconds.
+
+    consonant : float
+        The fixed length of the sample in milliseconds.
+
+    cutoff : float
+        The cutoff of the sample in milliseconds.
+
+    intensity : float
+        The note's intensity in percent.
+
+    modulation : float
+        The note's modulation in percent.
+
+    tempo : float
+        The tempo at the note.
+
+    pitchbend : str
+        The encoded pitchbend. See encode_pitchbend.
+    """
+    def __init__(self, index: int, note: Note, input_file: str, output_file: str, note_num: int = 60,
+                 velocity: float = 100, flags: str = '', offset: float = 0, length: float = 0,
+                 consonant: float = 0, cutoff: float = 0, intensity: float = 100, modulation: float = 0,
+                 tempo: float = 120, pitchbend: str = 'AA'):
+        self.index: int = index
+        self.note: Note = note
+        self.input_file: str = input_file
+        self.output_file: str = output_file
+        self.note_num: int = note_num
+        self.velocity: float = velocity
+        self.flags: str = flags
+        self.offset: float = offset
+        self.length: float = length
+        self.consonant: float = consonant
+        self.cutoff: float = cutoff
+        self.intensity: float = intensity
+        self.modulation: float = modulation
+        self.tempo: float = tempo
+        self.pitchbend: str = pitchbend
+
+    def args(self) -> list[str]:
+        '''Returns the command line arguments for the resampler.'''
+        return [self.input_file, self.output_file, note_name(self.note_num), _format_float(self.velocity), self.flags,
+                _format_float(self.offset), f'{self.length:.0f}', _format_float(self.consonant), _format_float(self.cutoff),
+                _format_float(self.intensity), _format_float(self.modulation), f'!{_format_float(self.tempo)}', self.pitchbend]
+
+class WavtoolJob:
+    """
+    A class for the arguments of one wavtool call.
+
+    Attributes
+    ----------
+    index : int
+        The index of the note in the Timeline.
+
+    note : Note
+        The note being appended.
+
+    output_file : str
+        The file the wavtool appends to.
+
+    input_file : str
+        The rendered note. Rest notes use 'R.wav', which does not exist, just like UTAU does.
+
+    start_point : float
+        How much to cut from the start of the rendered note in milliseconds.
+
+    length : int
+        The note's length in ticks.
+
+    tempo : float
+        The tempo at the note.
+
+    correction : float
+        The length added to the note in milliseconds. This is the pre-utterance minus how much the next note eats into this one.
+
+    envelope : list of float
+        The envelope as p1, p2, p3, v1, v2, v3, v4, overlap, p4, p5, v5.
+    """
+    def __init__(self, index: int, note: Note, output_file: str, input_file: str, start_point: float = 0,
+                 length: int = 480, tempo: float = 120, correction: float = 0, envelope: Sequence[float] = ()):
+        self.index: int = index
+        self.note: Note = note
+        self.output_file: str = output_file
+        self.input_file: str = input_file
+        self.start_point: float = start_point
+        self.length: int = length
+        self.tempo: float = tempo
+        self.correction: float = correction
+        self.envelope: list[float] = list(envelope)
+
+    def args(self) -> list[str]:
+        '''Returns the command line arguments for the wavtool.'''
+        sign = '+' if self.correction >= 0 else '-'
+        res = [self.output_file, self.input_file, _format_float(self.start_point),
+               f'{self.length}@{_format_float(self.tempo)}{sign}{_format_float(abs(self.correction))}']
+        res.extend([_format_float(x) for x in self.envelope])
+        return res
+
+class RenderProgress:
+    """
+    A class for progress updates while rendering.
+
+    Attributes
+    ----------
+    stage : str
+        'resample' or 'concatenate'.
+
+    done : int
+        How many jobs of the stage are done.
+
+    total : int
+        How many jobs the stage has.
+
+    job : ResamplerJob or WavtoolJob
+        The job that just finished.
+
+    skipped : bool
+        If the job was skipped because its output was still valid or was found in the cache.
+    """
+    def __init__(self, stage: str, done: int, total: int, job: ResamplerJob | WavtoolJob, skipped: bool = False):
+        self.stage: str = stage
+        self.done: int = done
+        self.total: int = total
+        self.job: ResamplerJob | WavtoolJob = job
+        self.skipped: bool = skipped
+
+    def __repr__(self) -> str:
+        return f'RenderProgress({self.stage!r}, {self.done}/{self.total}{", skipped" if self.skipped else ""})'
+
+#Resamplers and wavtools can either be commands or Python callables that take the job.
+Tool = str | Sequence[str] | Callable[[ResamplerJob | WavtoolJob], None]
+
+def _run_tool(tool: Tool, job: ResamplerJob | WavtoolJob) -> None:
+    if callable(tool):
+        tool(job)
+    else:
+        cmd = [tool] if isinstance(tool, str) else list(tool)
+        subprocess.run(cmd + job.args(), check = True, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+class RenderPipeline:
+    """
+    Renders a UtauPlugin by calling a resampler for each note in parallel and then a wavtool for each note in order.
+
+    Attributes
+    ----------
+    plugin : UtauPlugin
+        The plugin data. Notes need the @filename, @alias and @cache data UTAU sends.
+
+    timeline : Timeline
+        The positions of the notes.
+
+    resampler : str, sequence of str or callable
+        The resampler command, or a callable that takes a ResamplerJob.
+
+    wavtool : str, sequence of str, callable or None
+        The wavtool command, or a callable that takes a WavtoolJob. None mixes the notes with pyutau.wavtool instead.
+
+    output_file : str
+        The rendered file.
+
+    cache_dir : str
+        Where notes without @cache are rendered to.
+
+    workers : int or None
+        The number of resampler calls running at once. None lets the executor decide.
+
+    oto : mapping of str to sequence of float
+        The offset, consonant and cutoff for each alias.
+
+    cache : RenderCache or None
+        The cache that renders are looked up in and saved to.
+    """
+    def __init__(self, plugin: UtauPlugin, resampler: Tool, wavtool: Tool | None = None, output_file: str | os.PathLike = 'temp.wav',
+                 cache_dir: str | os.PathLike | None = None, workers: int | None = None,
+                 oto: Mapping[str, Sequence[float]] | None = None, cache: RenderCache | None = None):
+        """
+        Sets up the render.
+
+        Parameters
+        ----------
+        plugin : UtauPlugin
+            The plugin data.
+
+        resampler : str, sequence of str or callable
+            The resampler command, or a callable that takes a ResamplerJob.
+
+        wavtool : str, sequence of str, callable or None
+            The wavtool command, or a callable that takes a WavtoolJob. Default is None, which mixes the notes
+            with pyutau.wavtool instead. This needs NumPy.
+
+        output_file : str or path-like
+            The rendered file. Default is 'temp.wav'.
+
+        cache_dir : str, path-like or None
+            Where notes without @cache are rendered to. Default is None, which makes a temporary folder.
+
+        workers : int or None
+            The number of resampler calls running at once. Default is None, which lets the executor decide.
+
+        oto : mapping of str to sequence of float or None
+            The offset, consonant and cutoff for each alias. Default is None, which uses 0 for all of them.
+
+        cache : RenderCache or None
+            The cache that renders are looked up in and saved to. Default is None.
+        """
+        self.plugin: UtauPlugin = plugin
+        self.timeline: Timeline = Timeline(plugin)
+        self.resampler: Tool = resampler
+        self.wavtool: Tool | None = wavtool
+        self.output_file: str = os.fspath(output_file)
+        self.cache_dir: str = os.fspath(cache_dir) if cache_dir else tempfile.mkdtemp(prefix = 'pyutau')
+        self.workers: int | None = workers
+        self.oto: Mapping[str, Sequence[float]] = oto if oto != None else {}
+        self.cache: RenderCache | None = cache
+
+    def resampler_jobs(self) -> list[ResamplerJob]:
+        '''Returns the resampler jobs for every note that is not a rest note.'''
+        jobs = []
+        tl = self.timeline
+        flags = self.plugin.settings.get('Flags', '')
+        for i, note in enumerate(tl.notes):
+            if tl.is_silent(i):
+                continue
+            alias = note.get_alias() or note.get_lyric()
+            offset, consonant, cutoff = (list(self.oto.get(alias, ())) + [0, 0, 0])[:3]
+            preutterance = tl.preutterance(i)
+            start_point = tl.start_point(i)
+            length = start_point + tl.ms_lengths[i] + tl.correction(i)
+            length = math.ceil(max(length, consonant) / 50 + 0.5) * 50
+
+            #Pitch points are 5 ticks apart, starting from where the sample starts.
+            step = 5 * 125 / tl.tempos[i]
+            times = [-preutterance + k * step for k in range(int(length / step) + 1)]
+            pitches = pitch_curve(note, times, tl.get_prev(i), tl.tempos[i])
+
+            output = note.get_cache_location()
+            if not output:
+                output = os.path.join(self.cache_dir, f'{i:04d}_{note.get_note_num()}.wav')
+            note_flags = note.get_flags()
+            jobs.append(ResamplerJob(i, note, note.get_sample_filename(), output, note.get_note_num(),
+                                     velocity = _first_float(note, 'Velocity', default = 100),
+                                     flags = note_flags if note_flags != None else flags,
+                                     offset = offset, length = length, consonant = consonant, cutoff = cutoff,
+                                     intensity = _first_float(note, 'Intensity', default = 100),
+                                     modulation = _first_float(note, 'Modulation'),
+                                     tempo = tl.tempos[i], pitchbend = encode_pitchbend(pitches)))
+        return jobs
+
+    def wavtool_jobs(self, rendered: Mapping[int, str] | None = None) -> list[WavtoolJob]:
+        """
+        Returns the wavtool jobs for every note in order.
+
+        Parameters
+        ----------
+        rendered : mapping of int to str or None
+            The rendered file of each note by index. Default is None, which takes them from resampler_jobs.
+        """
+        if rendered == None:
+            rendered = {job.index: job.output_file for job in self.resampler_jobs()}
+        jobs = []
+        tl = self.timeline
+        for i, note in enumerate(tl.notes):
+            if i not in rendered:
+                jobs.append(WavtoolJob(i, note, self.output_file, 'R.wav', 0, tl.lengths[i], tl.tempos[i],
+                                       tl.correction(i), [0, 0]))
+                continue
+            envelope = note.get_envelope()
+            if envelope == None:
+                envelope = Envelope()
+            env = [*envelope.p[:3], *envelope.v[:4], tl.overlap(i)]
+            if len(envelope.p) >= 4:
+                env.append(envelope.p[3])
+            if len(envelope.p) == 5:
+                env.extend([envelope.p[4], envelope.v[4]])
+            jobs.append(WavtoolJob(i, note, self.output_file, rendered[i],
+                                   tl.start_point(i), tl.lengths[i], tl.tempos[i],
+                                   tl.correction(i), env))
+        return jobs
+
+    def is_valid(self, job: ResamplerJob) -> bool:
+        """
+        Checks if the output of a resampler job can be reused.
+
+        Parameters
+        ----------
+        job : ResamplerJob
+            The job.
+
+        Notes
+        -----
+        Only @cache files are trusted. They are valid when they exist, have audio in them and are newer than the sample.
+        """
+        if job.output_file != job.note.get_cache_location():
+            return False
+        try:
+            stat = os.stat(job.output_file)
+        except OSError:
+            return False
+        if stat.st_size <= 44:
+            return False
+        try:
+            return stat.st_mtime >= os.path.getmtime(job.input_file)
+        except OSError:
+            return True
+
+    def _resample(self, job: ResamplerJob, resampler_id: str = '') -> bool:
+        if self.is_valid(job):
+            return True
+        os.makedirs(os.path.dirname(job.output_file) or '.', exist_ok = True)
+        if self.cache != None:
+            from pyutau.cache import render_key
+            key = render_key(job, resampler_id)
+            if self.cache.get_into(key, job.output_file):
+                return True
+            _run_tool(self.resampler, job)
+            self.cache.put(key, job.output_file)
+        else:
+            _run_tool(self.resampler, job)
+        return False
+
+    def run(self) -> Iterator[RenderProgress]:
+        '''Renders the plugin, yielding progress after every job.'''
+        jobs = self.resampler_jobs()
+        resampler_id = ''
+        if self.cache != None:
+            #Renders from another resampler sound different, so they can't be shared.
+            from pyutau.cache import tool_id
+            resampler_id = tool_id(self.resampler)
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            futures = {executor.submit(self._resample, job, resampler_id): job for job in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                yield RenderProgress('resample', done, len(jobs), futures[future], future.result())
+        if self.cache != None:
+            self.cache.flush()
+
+        #The wavtool appends, so start from nothing.
+        for fpath in [self.output_file, self.output_file + '.whd', self.output_file + '.dat']:
+            if os.path.exists(fpath):
+                os.remove(fpath)
+
+        wav_jobs = self.wavtool_jobs({job.index: job.output_file for job in jobs})
+        if self.wavtool == None:
+            yield from self._mix(wav_jobs)
+            return
+
+        for done, job in enumerate(wav_jobs, 1):
+            _run_tool(self.wavtool, job)
+            yield RenderProgress('concatenate', done, len(wav_jobs), job)
+
+        #Classic wavtools write the header and the data separately. UTAU joins them afterwards.
+        whd = self.output_file + '.whd'
+        dat = self.output_file + '.dat'
+        if os.path.exists(whd) and os.path.exists(dat):
+            with open(self.output_file, 'wb') as f:
+                for fpath in [whd, dat]:
+                    with open(fpath, 'rb') as part:
+                        shutil.copyfileobj(part, f)
+                    os.remove(fpath)
+
+    def _mix(self, jobs: list[WavtoolJob]) -> Iterator[RenderProgress]:
+        #Same placement as the wavtool, except every note is added to one buffer by pyutau.wavtool.
+        from pyutau.wavtool import render_track
+        import wave
+
+        tl = self.timeline
+        rendered = {job.index: job.input_file for job in jobs if not tl.is_silent(job.index)}
+        sample_rate = 44100
+        if rendered:
+            with wave.open(next(iter(rendered.values())), 'rb') as f:
+                sample_rate = f.getframerate()
+        render_track(tl, rendered, self.output_file, sample_rate)
+        #Mixing is done in one go, so progress comes after it.
+        for done, job in enumerate(jobs, 1):
+            yield RenderProgress('concatenate', done, len(jobs), job)
+
+    def render(self, callback: Callable[[RenderProgress], None] | None = None) -> str:
+        """
+        Renders the plugin and returns the path of the rendered file.
+
+        Parameters
+        ----------
+        callback : callable or None
+            Called with a RenderProgress after every job. Default is None.
+        """
+        for progress in self.run():
+            if callback:
+                callback(progress)
+        return self.output_file
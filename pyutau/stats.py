@@ -0,0 +1,426 @@
+from __future__ import annotations
+from collections import Counter
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import math
+import os
+import re
+
+from pyutau.pyutau import _decode, _is_rest
+
+__all__ = [
+    'CorpusStats',
+    'collect_stats',
+    'iter_notes',
+    'iter_sections'
+    ]
+
+#The only note data the statistics need. Everything else is skipped without being stored.
+_KEYS = {'Length', 'Lyric', 'NoteNum', 'Tempo', 'Flags', '@alias', 'VoiceDir'}
+_FLAG = re.compile(r'([A-Za-z]+)([+-]?\d*)')
+
+def iter_sections(data: bytes, encoding: str | None = None,
+                  keys: Collection[str] | None = None) -> Iterator[tuple[str, dict[str, str]]]:
+    """
+    Reads UST data section by section into plain dictionaries, without making Note objects.
+
+    Parameters
+    ----------
+    data : bytes
+        The raw UST data.
+
+    encoding : str or None
+        The encoding of the UST. Defaults to None, which detects it. See detect_encoding.
+
+    keys : collection of str or None
+        The only keys to keep. Default is None, which keeps everything.
+
+    Returns
+    -------
+    sections : iterator of tuple of str and dict
+        The name of each section, like 'SETTING', 'PREV', '0000' or 'INSERT', and its data. VERSION is skipped.
+    """
+    text, _ = _decode(data, encoding)
+    every_key = keys == None
+    name = None
+    target = None
+    for line in text.split('\n'):
+        if line[:2] == '[#':
+            if target != None:
+                yield name, target
+            name = line.rstrip('\r]')[2:]
+            target = {} if name != 'VERSION' else None
+            continue
+        if target == None:
+            continue
+        key, sep, value = line.partition('=')
+        if sep and (every_key or key in keys):
+            target[key] = value.rstrip('\r')
+    if target != None:
+        yield name, target
+
+def iter_notes(data: bytes, encoding: str | None = None) -> Iterator[tuple[dict[str, str], dict[str, str]]]:
+    """
+    Reads the notes of UST data section by section, without making Note objects.
+
+    Parameters
+    ----------
+    data : bytes
+        The raw UST data.
+
+    encoding : str or None
+        The encoding of the UST. Defaults to None, which detects it. See detect_encoding.
+
+    Returns
+    -------
+    notes : iterator of tuple of dict
+        The settings read so far and the note data of each note, with only Length, Lyric, NoteNum, Tempo, Flags and
+        @alias kept. PREV, NEXT and DELETE notes are skipped. The settings dict is the same object every time.
+    """
+    settings = {}
+    for name, section in iter_sections(data, encoding, _KEYS):
+        if name == 'SETTING':
+            settings.update(section)
+        elif name.isdigit() or name == 'INSERT':
+            yield settings, section
+
+class CorpusStats:
+    """
+    A class that counts things over many USTs. Counts from different workers can be added together.
+
+    Attributes
+    ----------
+    files : int
+        The number of files read.
+
+    notes : int
+        The number of notes read, including rests.
+
+    pitches : Counter of int
+        How many sung notes have each NoteNum.
+
+    intervals : Counter of int
+        How many times each interval in semitones comes between two sung notes in a row. Rests break the chain.
+
+    lyrics : Counter of str
+        How many notes have each lyric, including rests.
+
+    aliases : Counter of str
+        How many notes have each @alias. Only USTs UTAU sent to a plugin have these.
+
+    tempos : Counter of float
+        How many notes are at each tempo.
+
+    flags : Counter of str
+        How many sung notes use each flag, like 'g' or 'B'. The UST-wide flags count for notes without their own.
+
+    lengths : Counter of int
+        How many notes have each Length in ticks, including rests.
+
+    coverage : dict of str to Counter of str
+        How many sung notes use each alias, by VoiceDir. The lyric is used when there's no @alias.
+
+    errors : dict of str to str
+        The files that couldn't be read, with the reason.
+    """
+    def __init__(self):
+        self.files: int = 0
+        self.notes: int = 0
+        self.pitches: Counter[int] = Counter()
+        self.intervals: Counter[int] = Counter()
+        self.lyrics: Counter[str] = Counter()
+        self.aliases: Counter[str] = Counter()
+        self.tempos: Counter[float] = Counter()
+        self.flags: Counter[str] = Counter()
+        self.lengths: Counter[int] = Counter()
+        self.coverage: dict[str, Counter[str]] = {}
+        self.errors: dict[str, str] = {}
+
+    def add_bytes(self, data: bytes, encoding: str | None = None) -> None:
+        """
+        Counts one UST from its raw data.
+
+        Parameters
+        ----------
+        data : bytes
+            The raw UST data.
+
+        encoding : str or None
+            The encoding of the UST. Defaults to None, which detects it. See detect_encoding.
+
+        Notes
+        -----
+        Like Timeline, the first note starts at the tempo of the PREV note, then the Tempo setting, then 120.
+        """
+        #Counting into plain dicts first and adding them in at the end is a lot faster than Counter per note.
+        pitches = {}
+        intervals = {}
+        lyrics = {}
+        aliases = {}
+        tempos = {}
+        flags = {}
+        lengths = {}
+        covered = {}
+        flag_names = {}
+        settings = {}
+        prev_tempo = None
+        voice_dir = None
+        tempo = None
+        prev_num = None
+        count = 0
+        #Sections instead of iter_notes, since the PREV note's tempo is where the first note starts, like in Timeline.
+        for name, note in iter_sections(data, encoding, _KEYS):
+            if name == 'SETTING':
+                settings.update(note)
+                continue
+            if name == 'PREV':
+                prev_tempo = note.get('Tempo')
+                continue
+            if not (name.isdigit() or name == 'INSERT'):
+                continue
+            if voice_dir == None:
+                voice_dir = settings.get('VoiceDir', '')
+                tempo = 120.0
+                for value in [settings.get('Tempo'), prev_tempo]:
+                    value = float(value) if value else math.nan
+                    if math.isfinite(value):
+                        tempo = round(value, 2)
+            count += 1
+            #inf and nan are skipped, so they don't end up as keys.
+            if 'Tempo' in note:
+                value = float(note['Tempo'])
+                if math.isfinite(value):
+                    tempo = round(value, 2)
+            tempos[tempo] = tempos.get(tempo, 0) + 1
+            length = note.get('Length')
+            if length:
+                length = float(length)
+                if math.isfinite(length):
+                    length = int(length)
+                    lengths[length] = lengths.get(length, 0) + 1
+            lyric = note.get('Lyric', '')
+            lyrics[lyric] = lyrics.get(lyric, 0) + 1
+            alias = note.get('@alias')
+            if alias != None:
+                aliases[alias] = aliases.get(alias, 0) + 1
+            if _is_rest(lyric):
+                prev_num = None
+                continue
+
+            note_num = note.get('NoteNum')
+            if note_num:
+                note_num = int(note_num)
+                pitches[note_num] = pitches.get(note_num, 0) + 1
+                if prev_num != None:
+                    interval = note_num - prev_num
+                    intervals[interval] = intervals.get(interval, 0) + 1
+                prev_num = note_num
+            #Most notes share a few flag strings, so each one is only split once.
+            flag_str = note.get('Flags', settings.get('Flags', ''))
+            names = flag_names.get(flag_str)
+            if names == None:
+                names = flag_names[flag_str] = {m.group(1) for m in _FLAG.finditer(flag_str)}
+            for flag in names:
+                flags[flag] = flags.get(flag, 0) + 1
+            key = alias if alias != None else lyric
+            covered[key] = covered.get(key, 0) + 1
+
+        self.files += 1
+        self.notes += count
+        self.pitches.update(pitches)
+        self.intervals.update(intervals)
+        self.lyrics.update(lyrics)
+        self.aliases.update(aliases)
+        self.tempos.update(tempos)
+        self.flags.update(flags)
+        self.lengths.update(lengths)
+        if covered:
+            self.coverage.setdefault(voice_dir, Counter()).update(covered)
+
+    def add_file(self, fpath: str | os.PathLike, encoding: str | None = None) -> bool:
+        """
+        Counts one UST. Files that can't be read are put in errors instead of raising.
+
+        Parameters
+        ----------
+        fpath : str or path-like
+            The path to the UST.
+
+        encoding : str or None
+            The encoding of the UST. Defaults to None, which detects it. See detect_encoding.
+
+        Returns
+        -------
+        counted : bool
+            If the file was counted.
+        """
+        try:
+            with open(fpath, 'rb') as f:
+                data = f.read()
+            #Count into a new object, so a file that breaks halfway doesn't leave half its notes counted.
+            res = CorpusStats()
+            res.add_bytes(data, encoding)
+        except Exception as e:
+            self.errors[os.fspath(fpath)] = f'{type(e).__name__}: {e}'
+            return False
+        self.merge(res)
+        return True
+
+    def merge(self, other: CorpusStats) -> CorpusStats:
+        """
+        Adds the counts of another CorpusStats to this one.
+
+        Parameters
+        ----------
+        other : CorpusStats
+            The other counts. It isn't changed.
+
+        Returns
+        -------
+        stats : CorpusStats
+            This CorpusStats.
+        """
+        self.files += other.files
+        self.notes += other.notes
+        for name in ['pitches', 'intervals', 'lyrics', 'aliases', 'tempos', 'flags', 'lengths']:
+            getattr(self, name).update(getattr(other, name))
+        for voice_dir, counts in other.coverage.items():
+            self.coverage.setdefault(voice_dir, Counter()).update(counts)
+        self.errors.update(other.errors)
+        return self
+
+    def __iadd__(self, other: CorpusStats) -> CorpusStats:
+        return self.merge(other)
+
+    def __add__(self, other: CorpusStats) -> CorpusStats:
+        return CorpusStats().merge(self).merge(other)
+
+    def missing_aliases(self, aliases: Iterable[str], voice_dir: str | None = None) -> list[str]:
+        """
+        Returns the aliases of a voicebank that no note uses.
+
+        Parameters
+        ----------
+        aliases : iterable of str
+            Every alias of the voicebank, like the keys of an oto.ini.
+
+        voice_dir : str or None
+            Only counts notes of this VoiceDir. Default is None, which counts every voicebank.
+
+        Returns
+        -------
+        aliases : list of str
+            The unused aliases, in the order given.
+        """
+        if voice_dir != None:
+            used = self.coverage.get(voice_dir, Counter())
+        else:
+            used = Counter()
+            for counts in self.coverage.values():
+                used.update(counts)
+        return [x for x in aliases if x not in used]
+
+    def to_dict(self) -> dict:
+        '''Returns the counts as a dictionary that can be saved as JSON. See from_dict.'''
+        return {
+            'files' : self.files,
+            'notes' : self.notes,
+            'pitches' : {str(k): v for k, v in self.pitches.items()},
+            'intervals' : {str(k): v for k, v in self.intervals.items()},
+            'lyrics' : dict(self.lyrics),
+            'aliases' : dict(self.aliases),
+            'tempos' : {repr(k): v for k, v in self.tempos.items()},
+            'flags' : dict(self.flags),
+            'lengths' : {str(k): v for k, v in self.lengths.items()},
+            'coverage' : {k: dict(v) for k, v in self.coverage.items()},
+            'errors' : dict(self.errors)
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> CorpusStats:
+        """
+        Makes a CorpusStats from a dictionary made by to_dict.
+
+        Parameters
+        ----------
+        data : dict
+            The dictionary.
+        """
+        res = cls()
+        res.files = data['files']
+        res.notes = data['notes']
+        res.pitches = Counter({int(k): v for k, v in data['pitches'].items()})
+        res.intervals = Counter({int(k): v for k, v in data['intervals'].items()})
+        res.lyrics = Counter(data['lyrics'])
+        res.aliases = Counter(data['aliases'])
+        res.tempos = Counter({float(k): v for k, v in data['tempos'].items()})
+        res.flags = Counter(data['flags'])
+        res.lengths = Counter({int(k): v for k, v in data['lengths'].items()})
+        res.coverage = {k: Counter(v) for k, v in data['coverage'].items()}
+        res.errors = dict(data['errors'])
+        return res
+
+    def __repr__(self) -> str:
+        return f'CorpusStats({self.files} files, {self.notes} notes, {len(self.errors)} errors)'
+
+def _collect(args: tuple) -> CorpusStats:
+    #Runs in the worker processes. One CorpusStats per batch keeps what's sent back small.
+    paths, encoding = args
+    res = CorpusStats()
+    for fpath in paths:
+        res.add_file(fpath, encoding)
+    return res
+
+def collect_stats(paths: Iterable[str | os.PathLike], encoding: str | None = None, workers: int | None = None,
+                  batch_size: int = 64) -> CorpusStats:
+    """
+    Counts many USTs with a process pool. Only the counts are kept, never the files.
+
+    Parameters
+    ----------
+    paths : iterable of str or path-like
+        The USTs. They are read in batches as they come, so this can be a generator like os.scandir.
+
+    encoding : str or None
+        The encoding of the USTs. Defaults to None, which detects it for each file.
+
+    workers : int or None
+        The number of worker processes. Default is None, which lets the executor decide. 0 reads in this process.
+
+    batch_size : int
+        The number of files each worker counts before sending its counts back. Default is 64.
+
+    Returns
+    -------
+    stats : CorpusStats
+        The counts of every file.
+    """
+    def batches() -> Iterator[tuple[list[str], str | None]]:
+        batch = []
+        for fpath in paths:
+            batch.append(os.fspath(fpath))
+            if len(batch) >= batch_size:
+                yield batch, encoding
+                batch = []
+        if batch:
+            yield batch, encoding
+
+    res = CorpusStats()
+    if workers == 0:
+        for batch in batches():
+            res.merge(_collect(batch))
+        return res
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        #Only keep a few batches per worker in flight, so a huge library isn't queued all at once.
+        limit = (workers or os.cpu_count() or 1) * 2
+        pending = set()
+        for batch in batches():
+            pending.add(executor.submit(_collect, batch))
+            if len(pending) >= limit:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    res.merge(future.result())
+        for future in pending:
+            res.merge(future.result())
+    return res
@@ -0,0 +1,296 @@
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+
+from pyutau.pyutau import Envelope, Note, UtauPlugin, _format_float, _parse_floats
+
+__all__ = [
+    'Issue',
+    'validate',
+    'validate_file',
+    'validate_files',
+    'NOTE_NUM_RANGE'
+    ]
+
+#The pitches UTAU's piano roll has. C1 to B7.
+NOTE_NUM_RANGE = (24, 107)
+
+_VBR_DEFAULT = ['65', '180', '35', '20', '20', '0', '0']
+
+class Issue:
+    """
+    A class for one problem found in a UST.
+
+    Attributes
+    ----------
+    code : str
+        The kind of problem. One of 'line', 'length', 'note_num', 'mode2', 'vibrato', 'envelope', 'preutterance',
+        'overlap', 'tempo' or 'file'.
+
+    index : int or None
+        The index of the note in UtauPlugin.notes. None for problems that aren't in a note.
+
+    key : str or None
+        The note data or setting with the problem.
+
+    message : str
+        What's wrong.
+
+    fixed : bool
+        If the problem was fixed.
+    """
+    def __init__(self, code: str, index: int | None, key: str | None, message: str, fixed: bool = False):
+        self.code: str = code
+        self.index: int | None = index
+        self.key: str | None = key
+        self.message: str = message
+        self.fixed: bool = fixed
+
+    def __repr__(self) -> str:
+        return f'Issue({self.code!r}, {self.index}, {self.key!r}, {self.message!r}{", fixed" if self.fixed else ""})'
+
+    def __str__(self) -> str:
+        where = f'note {self.index}' if self.index != None else 'file'
+        return f'{where}: {self.message}{" (fixed)" if self.fixed else ""}'
+
+def _float(value: str | None) -> float | None:
+    #inf and nan count as unreadable, since nothing can be done with them and int() can't take them.
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+def _split(value: str | None) -> list[str]:
+    #A blank value is one blank entry, like Mode2Pitch reads it. Only missing data has no entries.
+    return value.split(',') if value != None else []
+
+def validate(plugin: UtauPlugin, fix: bool = False) -> list[Issue]:
+    """
+    Checks every note of a plugin in one pass.
+
+    Parameters
+    ----------
+    plugin : UtauPlugin
+        The plugin data.
+
+    fix : bool
+        If fixable problems are fixed in place. Default is False.
+
+    Returns
+    -------
+    issues : list of Issue
+        The problems in order.
+
+    Notes
+    -----
+    Lines without '=' are already skipped by UtauPlugin, so they count as fixed when fix is True.
+    Non-integer lengths are rounded, pitches are clamped to NOTE_NUM_RANGE, PBY and PBM are cut or padded to the
+    length of PBW, short VBR data is padded with the defaults instead of being reset, unreadable envelopes are reset,
+    and PreUtterance and VoiceOverlap are clamped to the length of the previous note.
+    Negative or unreadable lengths and the values UTAU calculates (@preuttr, @overlap) are only reported.
+    Numbers that are inf or nan count as unreadable.
+    """
+    issues = []
+    for line, text in plugin.invalid_lines:
+        issues.append(Issue('line', None, None, f"Line {line} has no '=': {text!r}", fix))
+    if fix:
+        plugin.invalid_lines = []
+
+    tempo = None
+    if plugin.prev_note:
+        tempo = _float(plugin.prev_note.note_data.get('Tempo'))
+    if tempo == None:
+        tempo = _float(plugin.settings.get('Tempo'))
+    if not tempo or tempo <= 0:
+        tempo = 120.0
+
+    #Length of the previous note in milliseconds. The PREV note counts.
+    prev_ms = None
+    if plugin.prev_note:
+        prev_length = _float(plugin.prev_note.note_data.get('Length'))
+        if prev_length != None and prev_length >= 0:
+            prev_ms = prev_length * 125 / tempo
+
+    for i, note in enumerate(plugin.notes):
+        if note.is_deleted:
+            continue
+        data = note.note_data
+        issue = lambda code, key, message, fixed = False: issues.append(Issue(code, i, key, message, fixed and fix))
+
+        if 'Tempo' in data:
+            value = _float(data['Tempo'])
+            if value == None or value <= 0:
+                issue('tempo', 'Tempo', f'Tempo is not a positive number: {data["Tempo"]!r}')
+            else:
+                tempo = value
+
+        length = _float(data.get('Length'))
+        if length == None:
+            issue('length', 'Length', f'Length is not a number: {data.get("Length")!r}')
+        elif length < 0:
+            issue('length', 'Length', f'Length is negative: {data["Length"]}')
+        elif length != int(length) or not data['Length'].strip().isdigit():
+            issue('length', 'Length', f'Length is not an integer: {data["Length"]!r}', True)
+            if fix:
+                note.set_length(int(round(length)))
+                length = note.get_length()
+
+        note_num = _float(data.get('NoteNum'))
+        if note_num == None or note_num != int(note_num):
+            issue('note_num', 'NoteNum', f'NoteNum is not an integer: {data.get("NoteNum")!r}', note_num != None)
+            if fix and note_num != None:
+                note_num = round(note_num)
+                note.set_note_num(note_num)
+        if note_num != None and not NOTE_NUM_RANGE[0] <= note_num <= NOTE_NUM_RANGE[1]:
+            issue('note_num', 'NoteNum', f'NoteNum is out of range: {int(note_num)}', True)
+            if fix:
+                note.set_note_num(int(min(max(note_num, NOTE_NUM_RANGE[0]), NOTE_NUM_RANGE[1])))
+
+        _check_mode2(note, issue, fix)
+        _check_vibrato(note, issue, fix)
+        _check_envelope(note, issue, fix)
+
+        if prev_ms != None:
+            for key, code, name in [('PreUtterance', 'preutterance', 'PreUtterance'), ('VoiceOverlap', 'overlap', 'VoiceOverlap'),
+                                    ('@preuttr', 'preutterance', '@preuttr'), ('@overlap', 'overlap', '@overlap')]:
+                value = _float(data.get(key))
+                if value != None and value > prev_ms:
+                    fixable = not key.startswith('@')
+                    issue(code, key, f'{name} is longer than the previous note: {value:g} > {prev_ms:g} ms', fixable)
+                    if fix and fixable:
+                        data[key] = _format_float(prev_ms)
+
+        prev_ms = length * 125 / tempo if length != None and length >= 0 else None
+    return issues
+
+def _check_mode2(note: Note, issue, fix: bool) -> None:
+    data = note.note_data
+    if 'PBS' not in data:
+        return
+    if 'PBW' not in data:
+        #get_mode2pitch can't read this at all.
+        issue('mode2', 'PBW', 'PBS without PBW', True)
+        if fix:
+            for k in ['PBS', 'PBY', 'PBM']:
+                data.pop(k, None)
+        return
+    try:
+        float(data['PBS'].split(';')[0])
+        pbw = _parse_floats(_split(data['PBW']))
+        pby = _parse_floats(_split(data.get('PBY')))
+    except ValueError:
+        issue('mode2', 'PBS', 'Mode2 pitchbend has numbers that are not numbers')
+        return
+    pbm = _split(data.get('PBM'))
+    for key, values, pad in [('PBY', pby, 0), ('PBM', pbm, '')]:
+        if key in data and len(values) != len(pbw):
+            issue('mode2', key, f'{key} has {len(values)} points but PBW has {len(pbw)}', True)
+            if fix:
+                values = (values + [pad] * len(pbw))[:len(pbw)]
+                data[key] = ','.join(values) if key == 'PBM' else ','.join(_format_float(x) for x in values)
+
+def _check_vibrato(note: Note, issue, fix: bool) -> None:
+    data = note.note_data
+    if 'VBR' not in data:
+        return
+    #Vibrato reads a blank VBR as the defaults.
+    values = _split(data['VBR']) if data['VBR'] else []
+    try:
+        [float(x) for x in values if x != '']
+    except ValueError:
+        issue('vibrato', 'VBR', f'VBR has values that are not numbers: {data["VBR"]!r}')
+        return
+    if len(values) < 7:
+        #Vibrato() would quietly reset every value, so keep the ones that are there.
+        issue('vibrato', 'VBR', f'VBR has {len(values)} values instead of 7', True)
+        if fix:
+            data['VBR'] = ','.join(values + _VBR_DEFAULT[len(values):])
+
+def _check_envelope(note: Note, issue, fix: bool) -> None:
+    data = note.note_data
+    if 'Envelope' not in data:
+        return
+    values = _split(data['Envelope'])
+    problem = None
+    if len(values) > 11:
+        problem = f'Envelope has {len(values)} values'
+    elif '%' in values and values.index('%') != 7:
+        problem = "Envelope has '%' in the wrong place"
+    else:
+        try:
+            envelope = Envelope(data['Envelope'])
+            if min(envelope.p) < 0 or min(envelope.v) < 0:
+                problem = 'Envelope has negative values'
+        except (ValueError, IndexError):
+            problem = f'Envelope has values that are not numbers: {data["Envelope"]!r}'
+    if problem:
+        issue('envelope', 'Envelope', problem, True)
+        if fix:
+            data['Envelope'] = str(Envelope())
+
+def validate_file(fpath: str | os.PathLike, fix: bool = False, output: str | os.PathLike | None = None) -> list[Issue]:
+    """
+    Reads and checks a UST. Nothing is raised for broken files, they're reported instead.
+
+    Parameters
+    ----------
+    fpath : str or path-like
+        The path to the UST.
+
+    fix : bool
+        If fixable problems are fixed. Default is False.
+
+    output : str, path-like or None
+        Where to write the fixed UST. Default is None, which doesn't write anything.
+
+    Returns
+    -------
+    issues : list of Issue
+        The problems in order. A file that couldn't be read at all has one 'file' issue.
+    """
+    try:
+        plugin = UtauPlugin(fpath)
+        issues = validate(plugin, fix)
+        if output != None:
+            plugin.write(output)
+        return issues
+    except Exception as e:
+        return [Issue('file', None, None, f'{type(e).__name__}: {e}')]
+
+def _validate_one(args: tuple) -> tuple[str, list[Issue]]:
+    fpath, fix, output_dir = args
+    output = os.path.join(output_dir, os.path.basename(fpath)) if output_dir != None else None
+    return fpath, validate_file(fpath, fix, output)
+
+def validate_files(paths: Iterable[str | os.PathLike], fix: bool = False, output_dir: str | os.PathLike | None = None,
+                   workers: int | None = None) -> Iterator[tuple[str, list[Issue]]]:
+    """
+    Checks many USTs with a process pool.
+
+    Parameters
+    ----------
+    paths : iterable of str or path-like
+        The USTs.
+
+    fix : bool
+        If fixable problems are fixed. Default is False.
+
+    output_dir : str, path-like or None
+        Where to write the fixed USTs, under their own file names. Default is None, which doesn't write anything.
+
+    workers : int or None
+        The number of worker processes. Default is None, which lets the executor decide.
+
+    Returns
+    -------
+    results : iterator of tuple of str and list of Issue
+        The path and problems of each UST, in order.
+    """
+    if output_dir != None:
+        os.makedirs(output_dir, exist_ok = True)
+    jobs = ((os.fspath(p), fix, output_dir) for p in paths)
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        yield from executor.map(_validate_one, jobs, chunksize = 16)
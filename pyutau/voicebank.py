@@ -0,0 +1,347 @@
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+import math
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from pyutau.pyutau import UtauPlugin
+
+__all__ = [
+    'FrqFile',
+    'WavHeader',
+    'SampleInfo',
+    'frq_path',
+    'note_num_to_hz',
+    'read_sample',
+    'scan_voicebank',
+    'sample_deviations'
+    ]
+
+_FRQ_HEADER = struct.Struct('<8sid16si')
+
+def frq_path(sample: str | os.PathLike) -> str:
+    """
+    Returns the path of the .frq file UTAU makes for a sample. 'a.wav' has 'a_wav.frq'.
+
+    Parameters
+    ----------
+    sample : str or path-like
+        The path of the sample.
+    """
+    root, ext = os.path.splitext(os.fspath(sample))
+    return f'{root}_{ext[1:]}.frq'
+
+def note_num_to_hz(note_num: float) -> float:
+    """
+    Converts a NoteNum to frequency in Hz. A4 = 69 = 440 Hz.
+
+    Parameters
+    ----------
+    note_num : float
+        The pitch.
+    """
+    return 440 * 2 ** ((note_num - 69) / 12)
+
+def _map(fpath: str | os.PathLike) -> mmap.mmap:
+    with open(fpath, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+def _close(mm: mmap.mmap) -> None:
+    #The map can't be closed while arrays still point into it. Garbage collection closes it in that case.
+    try:
+        mm.close()
+    except BufferError:
+        pass
+
+class FrqFile:
+    """
+    A class that reads UTAU .frq frequency maps by memory-mapping them. The arrays point straight into the file.
+
+    Attributes
+    ----------
+    path : str
+        The path of the .frq file.
+
+    hop_size : int
+        The number of samples between frames.
+
+    average_f0 : float
+        The average frequency written in the header in Hz.
+
+    f0 : np.ndarray
+        The frequency of each frame in Hz. 0 is unvoiced. Read-only.
+
+    amplitude : np.ndarray
+        The amplitude of each frame. Read-only.
+    """
+    def __init__(self, fpath: str | os.PathLike):
+        """
+        Memory-maps an .frq file.
+
+        Parameters
+        ----------
+        fpath : str or path-like
+            The path of the .frq file.
+        """
+        self.path: str = os.fspath(fpath)
+        self._mm = _map(fpath)
+        if len(self._mm) < _FRQ_HEADER.size:
+            _close(self._mm)
+            raise ValueError(f'Not an frq file: {self.path}')
+        magic, hop_size, average_f0, _, frames = _FRQ_HEADER.unpack_from(self._mm)
+        if magic[:4] != b'FREQ':
+            _close(self._mm)
+            raise ValueError(f'Not an frq file: {self.path}')
+        #Trust the file size over the frame count, in case the file is cut short.
+        frames = min(frames, (len(self._mm) - _FRQ_HEADER.size) // 16)
+        data = np.frombuffer(self._mm, dtype = '<f8', count = frames * 2, offset = _FRQ_HEADER.size).reshape(-1, 2)
+        self.hop_size: int = hop_size
+        self.average_f0: float = average_f0
+        self.f0: np.ndarray = data[:, 0]
+        self.amplitude: np.ndarray = data[:, 1]
+
+    def __len__(self) -> int:
+        return len(self.f0)
+
+    def times(self, sample_rate: int = 44100) -> np.ndarray:
+        """
+        Returns the time of each frame in milliseconds.
+
+        Parameters
+        ----------
+        sample_rate : int
+            The sample rate of the sample. Default is 44100.
+        """
+        return np.arange(len(self.f0)) * (self.hop_size * 1000 / sample_rate)
+
+    def median_f0(self) -> float:
+        '''Returns the median frequency of the voiced frames in Hz, or 0 if there are none.'''
+        voiced = self.f0[self.f0 > 0]
+        return float(np.median(voiced)) if len(voiced) else 0.0
+
+    def close(self) -> None:
+        '''Releases the memory map. The arrays can't be used after this.'''
+        self.f0 = self.amplitude = None
+        _close(self._mm)
+
+    def __enter__(self) -> FrqFile:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+class WavHeader:
+    """
+    A class that reads the header of a WAV sample.
+
+    Attributes
+    ----------
+    path : str
+        The path of the sample.
+
+    format : int
+        The format tag. 1 is PCM and 3 is float.
+
+    channels : int
+        The number of channels.
+
+    sample_rate : int
+        The sample rate.
+
+    bits : int
+        The bits per sample.
+
+    data_offset : int
+        Where the audio starts in the file in bytes.
+
+    data_size : int
+        The size of the audio in bytes.
+    """
+    def __init__(self, fpath: str | os.PathLike):
+        """
+        Reads the header of a WAV file.
+
+        Parameters
+        ----------
+        fpath : str or path-like
+            The path of the sample.
+        """
+        self.path: str = os.fspath(fpath)
+        mm = _map(fpath)
+        try:
+            if mm[:4] != b'RIFF' or mm[8:12] != b'WAVE':
+                raise ValueError(f'Not a WAV file: {self.path}')
+            fmt = None
+            data = None
+            pos = 12
+            while pos + 8 <= len(mm) and (fmt == None or data == None):
+                chunk_id = mm[pos:pos + 4]
+                size = struct.unpack_from('<I', mm, pos + 4)[0]
+                if chunk_id == b'fmt ':
+                    fmt = struct.unpack_from('<HHIIHH', mm, pos + 8)
+                elif chunk_id == b'data':
+                    #Some recorders write a bad size, so cut it to the file.
+                    data = (pos + 8, min(size, len(mm) - pos - 8))
+                pos += 8 + size + (size & 1)
+            if fmt == None or data == None:
+                raise ValueError(f'Incomplete WAV file: {self.path}')
+        finally:
+            _close(mm)
+
+        self.format: int = fmt[0]
+        self.channels: int = fmt[1]
+        self.sample_rate: int = fmt[2]
+        self.bits: int = fmt[5]
+        self.data_offset: int = data[0]
+        self.data_size: int = data[1]
+
+    @property
+    def frames(self) -> int:
+        '''The number of samples per channel.'''
+        return self.data_size // max(self.channels * self.bits // 8, 1)
+
+    @property
+    def duration(self) -> float:
+        '''The length of the sample in milliseconds.'''
+        return self.frames * 1000 / self.sample_rate
+
+    def samples(self) -> np.ndarray:
+        """
+        Memory-maps the audio of the sample.
+
+        Returns
+        -------
+        samples : np.ndarray
+            Read-only array of shape (frames, channels) in the file's own sample type.
+        """
+        if self.format == 3:
+            dtype = '<f4' if self.bits == 32 else '<f8'
+        elif self.bits == 8:
+            dtype = np.uint8
+        elif self.bits in [16, 32]:
+            dtype = f'<i{self.bits // 8}'
+        else:
+            raise ValueError(f'Unsupported sample width: {self.bits}')
+        return np.memmap(self.path, dtype = dtype, mode = 'r', offset = self.data_offset,
+                         shape = (self.frames, self.channels))
+
+class SampleInfo:
+    """
+    A class for what scan_voicebank finds out about a sample.
+
+    Attributes
+    ----------
+    path : str
+        The path of the sample.
+
+    header : WavHeader or None
+        The header of the sample. None if it couldn't be read.
+
+    median_f0 : float or None
+        The median frequency of the voiced frames of the .frq file in Hz. None if there is no .frq file.
+
+    frames : int
+        The number of frames in the .frq file.
+
+    error : str or None
+        Why the sample or .frq file couldn't be read, if it couldn't.
+    """
+    def __init__(self, path: str, header: WavHeader | None = None, median_f0: float | None = None,
+                 frames: int = 0, error: str | None = None):
+        self.path: str = path
+        self.header: WavHeader | None = header
+        self.median_f0: float | None = median_f0
+        self.frames: int = frames
+        self.error: str | None = error
+
+    def deviation(self, note_num: float) -> float | None:
+        """
+        Returns how far the sample's pitch is from a NoteNum in cents.
+
+        Parameters
+        ----------
+        note_num : float
+            The pitch the sample is used at.
+        """
+        if not self.median_f0:
+            return None
+        return 1200 * math.log2(note_num_to_hz(note_num) / self.median_f0)
+
+    def __repr__(self) -> str:
+        return f'SampleInfo({self.path!r}, median_f0={self.median_f0}, error={self.error!r})'
+
+def read_sample(fpath: str | os.PathLike) -> SampleInfo:
+    """
+    Reads the header and .frq summary of a sample. Errors are stored instead of raised.
+
+    Parameters
+    ----------
+    fpath : str or path-like
+        The path of the sample.
+    """
+    info = SampleInfo(os.fspath(fpath))
+    try:
+        info.header = WavHeader(fpath)
+        frq = frq_path(fpath)
+        if os.path.exists(frq):
+            with FrqFile(frq) as f:
+                info.median_f0 = f.median_f0()
+                info.frames = len(f)
+    except (OSError, ValueError, struct.error) as e:
+        info.error = str(e)
+    return info
+
+def _walk(directory: str | os.PathLike) -> Iterator[str]:
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith('.wav'):
+                yield os.path.join(root, name)
+
+def scan_voicebank(directory: str | os.PathLike | Iterable[str | os.PathLike], workers: int | None = None) -> Iterator[SampleInfo]:
+    """
+    Reads every sample of a voicebank with a thread pool.
+
+    Parameters
+    ----------
+    directory : str, path-like or iterable of them
+        The voicebank folder, which is searched for WAV files including subfolders, or the list of samples to read.
+
+    workers : int or None
+        The number of threads. Default is None, which lets the executor decide.
+
+    Returns
+    -------
+    samples : iterator of SampleInfo
+        The samples in order.
+    """
+    if isinstance(directory, (str, os.PathLike)):
+        directory = _walk(directory)
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        yield from executor.map(read_sample, directory)
+
+def sample_deviations(plugin: UtauPlugin, workers: int | None = None) -> list[tuple[int, str, float | None]]:
+    """
+    Checks how far every note's sample is from the NoteNum it is used at. Only notes with @filename are checked.
+
+    Parameters
+    ----------
+    plugin : UtauPlugin
+        The plugin data.
+
+    workers : int or None
+        The number of threads. Default is None, which lets the executor decide.
+
+    Returns
+    -------
+    deviations : list of tuple of int, str and float or None
+        The note index, the sample and the deviation in cents. The deviation is None when there is no .frq file.
+    """
+    used = [(i, note.get_sample_filename(), note.get_note_num()) for i, note in enumerate(plugin.notes)
+            if note.get_sample_filename() and not note.is_deleted]
+    samples = list(dict.fromkeys(s for _, s, _ in used))
+    infos = dict(zip(samples, scan_voicebank(samples, workers)))
+    return [(i, s, infos[s].deviation(n)) for i, s, n in used]
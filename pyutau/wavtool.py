@@ -0,0 +1,324 @@
+from __future__ import annotations
+from collections.abc import Mapping, Sequence
+import os
+import wave
+
+import numpy as np
+
+from pyutau.pyutau import Envelope, Timeline
+
+__all__ = [
+    'Mixer',
+    'read_wav',
+    'write_wav',
+    'envelope_curve',
+    'mixdown',
+    'render_track'
+    ]
+
+def read_wav(fpath: str | os.PathLike) -> tuple[np.ndarray, int]:
+    """
+    Reads a PCM WAV file as mono float32 audio from -1 to 1.
+
+    Parameters
+    ----------
+    fpath : str or path-like
+        The path to the WAV file.
+
+    Returns
+    -------
+    data : np.ndarray
+        The audio. Channels are averaged.
+
+    sample_rate : int
+        The sample rate of the audio.
+    """
+    with wave.open(os.fspath(fpath), 'rb') as f:
+        channels = f.getnchannels()
+        width = f.getsampwidth()
+        sample_rate = f.getframerate()
+        raw = f.readframes(f.getnframes())
+
+    if width == 1:
+        data = (np.frombuffer(raw, dtype = np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        data = np.frombuffer(raw, dtype = '<i2').astype(np.float32) / 32768
+    elif width == 3:
+        #No 24-bit dtype, so pad every sample to 32 bits.
+        b = np.frombuffer(raw, dtype = np.uint8).reshape(-1, 3)
+        data = (b[:, 0].astype(np.int32) << 8 | b[:, 1].astype(np.int32) << 16 | b[:, 2].astype(np.int32) << 24)
+        data = data.astype(np.float32) / 2147483648
+    elif width == 4:
+        data = np.frombuffer(raw, dtype = '<i4').astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f'Unsupported sample width: {width}')
+
+    if channels > 1:
+        data = data.reshape(-1, channels).mean(axis = 1)
+    return data, sample_rate
+
+def write_wav(fpath: str | os.PathLike, data: np.ndarray, sample_rate: int = 44100, chunk: int = 1 << 20) -> None:
+    """
+    Writes mono float audio as a 16-bit PCM WAV file. Audio outside -1 to 1 is clipped.
+
+    Parameters
+    ----------
+    fpath : str or path-like
+        The path to write the WAV file in.
+
+    data : np.ndarray
+        The audio. Memory-mapped arrays are written in chunks so they don't get loaded all at once.
+
+    sample_rate : int
+        The sample rate of the audio. Default is 44100.
+
+    chunk : int
+        The number of samples converted at a time. Default is 1048576.
+    """
+    with wave.open(os.fspath(fpath), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        for i in range(0, len(data), chunk):
+            block = np.clip(data[i:i + chunk], -1, 1) * 32767
+            f.writeframes(np.round(block).astype('<i2').tobytes())
+
+def envelope_curve(envelope: Envelope | None, n: int, sample_rate: int = 44100) -> np.ndarray:
+    """
+    Makes the gain curve of an envelope.
+
+    Parameters
+    ----------
+    envelope : Envelope or None
+        The envelope. None is the default envelope.
+
+    n : int
+        The length of the curve in samples.
+
+    sample_rate : int
+        The sample rate. Default is 44100.
+
+    Returns
+    -------
+    curve : np.ndarray
+        The gain at each sample, where 1 is 100%.
+
+    Notes
+    -----
+    p1 and p2 are measured from the start, p4 is measured from the end and p3 is measured from p4.
+    p5 is measured from p2 and only exists with the optional p4.
+    """
+    if envelope == None:
+        envelope = Envelope()
+    p = envelope.p
+    v = envelope.v
+    duration = n * 1000 / sample_rate
+    p4 = p[3] if len(p) >= 4 else 0
+    times = [0, p[0], p[0] + p[1]]
+    values = [0, v[0], v[1]]
+    if len(p) == 5:
+        times.append(p[0] + p[1] + p[4])
+        values.append(v[4])
+    times.extend([duration - p4 - p[2], duration - p4, duration])
+    values.extend([v[2], v[3], 0])
+    #Points that cross over each other get pushed forward, so np.interp gets increasing points.
+    times = np.maximum.accumulate(np.clip(times, 0, duration))
+    t = np.arange(n, dtype = np.float64) * (1000 / sample_rate)
+    return (np.interp(t, times, values) / 100).astype(np.float32)
+
+class Mixer:
+    """
+    A wavtool that overlap-adds notes into one buffer instead of appending to a file.
+
+    Attributes
+    ----------
+    buffer : np.ndarray
+        The mixed audio. Can be a memory-mapped array.
+
+    sample_rate : int
+        The sample rate of the audio.
+
+    origin : float
+        The time in milliseconds of the first sample of the buffer.
+    """
+    def __init__(self, duration: float, sample_rate: int = 44100, origin: float = 0,
+                 out: np.ndarray | str | os.PathLike | None = None):
+        """
+        Makes an empty buffer.
+
+        Parameters
+        ----------
+        duration : float
+            The length of the buffer in milliseconds.
+
+        sample_rate : int
+            The sample rate of the audio. Default is 44100.
+
+        origin : float
+            The time in milliseconds of the first sample of the buffer. Default is 0.
+
+        out : np.ndarray, str, path-like or None
+            A preallocated float32 array to mix into, or a path to memory-map a float32 buffer to.
+            Default is None, which allocates a new array.
+        """
+        n = int(np.ceil(duration * sample_rate / 1000))
+        if out is None:
+            self.buffer: np.ndarray = np.zeros(n, dtype = np.float32)
+        elif isinstance(out, np.ndarray):
+            if len(out) < n:
+                raise ValueError(f'Buffer is too short: {len(out)} < {n}')
+            self.buffer = out
+            self.buffer[:] = 0
+        else:
+            self.buffer = np.memmap(out, dtype = np.float32, mode = 'w+', shape = (max(n, 1),))
+        self.sample_rate: int = sample_rate
+        self.origin: float = origin
+
+    def add(self, fragment: np.ndarray | str | os.PathLike, position: float, duration: float,
+            envelope: Envelope | None = None, start_point: float = 0) -> None:
+        """
+        Adds a rendered note to the buffer.
+
+        Parameters
+        ----------
+        fragment : np.ndarray, str or path-like
+            The rendered note, or the path to it.
+
+        position : float
+            Where the note starts in milliseconds. This is the note's onset minus its pre-utterance.
+
+        duration : float
+            The length of the note in milliseconds, counted after start_point.
+
+        envelope : Envelope or None
+            The note's envelope. Default is None, which is the default envelope.
+
+        start_point : float
+            How much to cut from the start of the note in milliseconds. Default is 0.
+        """
+        if not isinstance(fragment, np.ndarray):
+            fragment, sample_rate = read_wav(fragment)
+            if sample_rate != self.sample_rate:
+                raise ValueError(f'Sample rate mismatch: {sample_rate} != {self.sample_rate}')
+        sr = self.sample_rate / 1000
+        skip = int(round(start_point * sr))
+        n = int(round(duration * sr))
+        fragment = fragment[skip:skip + n]
+        if len(fragment) < n:
+            fragment = np.pad(fragment, (0, n - len(fragment)))
+
+        start = int(round((position - self.origin) * sr))
+        lo = max(start, 0)
+        hi = min(start + n, len(self.buffer))
+        if hi <= lo:
+            return
+        curve = envelope_curve(envelope, n, self.sample_rate)
+        self.buffer[lo:hi] += fragment[lo - start:hi - start] * curve[lo - start:hi - start]
+
+    def write(self, fpath: str | os.PathLike) -> None:
+        """
+        Writes the buffer as a 16-bit PCM WAV file.
+
+        Parameters
+        ----------
+        fpath : str or path-like
+            The path to write the WAV file in.
+        """
+        write_wav(fpath, self.buffer, self.sample_rate)
+
+def mixdown(fragments: Sequence[np.ndarray | str | os.PathLike | None], positions: Sequence[float],
+            durations: Sequence[float], envelopes: Sequence[Envelope | None] | None = None,
+            start_points: Sequence[float] | None = None, sample_rate: int = 44100,
+            out: np.ndarray | str | os.PathLike | None = None) -> np.ndarray:
+    """
+    Overlap-adds rendered notes into one buffer.
+
+    Parameters
+    ----------
+    fragments : sequence of np.ndarray, str, path-like or None
+        The rendered notes or the paths to them. None is silence, like rest notes.
+
+    positions : sequence of float
+        Where each note starts in milliseconds. This is the note's onset minus its pre-utterance.
+
+    durations : sequence of float
+        The length of each note in milliseconds.
+
+    envelopes : sequence of Envelope or None
+        The envelope of each note. Default is None, which uses the default envelope for all notes.
+
+    start_points : sequence of float or None
+        How much to cut from the start of each note in milliseconds. Default is None, which cuts nothing.
+
+    sample_rate : int
+        The sample rate of the audio. Default is 44100.
+
+    out : np.ndarray, str, path-like or None
+        A preallocated float32 array to mix into, or a path to memory-map a float32 buffer to. Default is None.
+
+    Returns
+    -------
+    buffer : np.ndarray
+        The mixed audio. The first sample is at the earliest position or 0, whichever comes first.
+    """
+    positions = np.asarray(positions, dtype = np.float64)
+    durations = np.asarray(durations, dtype = np.float64)
+    origin = min(float(positions.min()), 0) if len(positions) else 0
+    end = float((positions + durations).max()) if len(positions) else 0
+    mixer = Mixer(end - origin, sample_rate, origin, out)
+    for i, fragment in enumerate(fragments):
+        if fragment is None:
+            continue
+        mixer.add(fragment, positions[i], durations[i], envelopes[i] if envelopes else None,
+                  start_points[i] if start_points else 0)
+    return mixer.buffer
+
+def render_track(timeline: Timeline, rendered: Mapping[int, np.ndarray | str | os.PathLike],
+                 output_file: str | os.PathLike | None = None, sample_rate: int = 44100,
+                 out: np.ndarray | str | os.PathLike | None = None) -> np.ndarray:
+    """
+    Mixes the rendered notes of a Timeline at their positions, like a wavtool would.
+
+    Parameters
+    ----------
+    timeline : Timeline
+        The positions of the notes.
+
+    rendered : mapping of int to np.ndarray, str or path-like
+        The rendered note or the path to it for each note index. Missing notes are silent.
+
+    output_file : str, path-like or None
+        Where to write the track as a WAV file. Default is None, which doesn't write anything.
+
+    sample_rate : int
+        The sample rate of the audio. Default is 44100.
+
+    out : np.ndarray, str, path-like or None
+        A preallocated float32 array to mix into, or a path to memory-map a float32 buffer to. Default is None.
+
+    Returns
+    -------
+    buffer : np.ndarray
+        The mixed audio.
+
+    Notes
+    -----
+    The pre-utterance, overlap, start point and envelope of each note are taken from the note data,
+    preferring the values calculated by UTAU (@preuttr, @overlap, @stpoint).
+    """
+    fragments = []
+    positions = []
+    durations = []
+    envelopes = []
+    start_points = []
+    for i, note in enumerate(timeline.notes):
+        fragments.append(rendered.get(i))
+        positions.append(timeline.ms[i] - timeline.preutterance(i))
+        durations.append(timeline.ms_lengths[i] + timeline.correction(i))
+        envelopes.append(note.get_envelope())
+        start_points.append(timeline.start_point(i))
+
+    buffer = mixdown(fragments, positions, durations, envelopes, start_points, sample_rate, out)
+    if output_file != None:
+        write_wav(output_file, buffer, sample_rate)
+    return buffer
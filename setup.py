@@ -15,6 +15,7 @@ setup(
     author_email='diamond.glacier16@gmail.com',
     url='https://github.com/UtaUtaUtau/pyUtau',
     keywords=['utau'],
+    extras_require={'numpy': ['numpy']},
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',